@@ -16,10 +16,19 @@ Susanne Flach, Hans-Jürgen Diller and Jukka Tyrkkö, as an offshoot of a bigger
  of text descriptors (Diller, De Smet & Tyrkkö 2011). CLMET3.1 is a principled collection of public domain 
  texts drawn from various online archiving projects. """
 
+import html
+import html.entities
+import io
 import os
+import posixpath
+import re
+import zipfile
+from dataclasses import dataclass
+from itertools import compress, repeat
+from typing import List, Optional
 import xml.etree.ElementTree as ET
 import datasets
-from bs4 import BeautifulSoup
+import numpy as np
 
 
 _CITATION = """@article{de2015corpus,
@@ -108,30 +117,139 @@ _CLASS_LIST = [
     "QUOT"
 ]
 _CLASS_LOOKUP = {tag: idx for idx, tag in enumerate(_CLASS_LIST)}
+# Directory of the zip that holds one sub-directory per format
+_TXT_DIR = "clmet/corpus/txt"
+_FORMATS = ["plain", "class", "pos"]
+_HEADER_TAGS = [
+    "id",
+    "period",
+    "quartcent",
+    "decade",
+    "year",
+    "genre",
+    "subgenre",
+    "title",
+    "notes",
+    "comments",
+    "author",
+]
+# Tokenizes markup the same way as html.parser: start tags with their (possibly
+# quoted) attributes, end tags (which may have spaces before the name, or no name
+# and then are dropped), CDATA sections, dropped comments, unterminated comments and
+# CDATA sections (kept as text up to the next ">"), and dropped declarations and
+# processing instructions
+_MARKUP_RE = re.compile(
+    r"<(?:([a-zA-Z][^\t\n\r\f />\x00]*)((?:[^>\"']|\"[^\"]*\"|'[^']*')*)>"
+    r"|/(?:\s*([a-zA-Z][-.a-zA-Z0-9:_]*)\s*>|([a-zA-Z][^\t\n\r\f />\x00]*)[^>]*>)"
+    r"|!\[(?i:cdata)\[(.*?)\]\s*\]\s*>"
+    r"|!--.*?--\s*>"
+    r"|(/>|!--[^>]*>|!\[(?i:cdata)\[[^>]*>)"
+    r"|/[^>]*>|[!?][^>]*>)",
+    re.DOTALL,
+)
+# Elements whose content html.parser passes through unparsed up to their end tag,
+# and which BeautifulSoup leaves out of .text
+_RAW_TEXT_END_RES = {
+    name: re.compile(rf"</\s*{name}\s*>", re.IGNORECASE) for name in ["script", "style"]
+}
+# Character references as html.parser finds them. Like BeautifulSoup, named
+# references are looked up without their semicolon and unknown ones are kept as text
+_CHARREF_RE = re.compile(r"&(?:#([0-9]+|[xX][0-9a-fA-F]+)|([a-zA-Z][-.a-zA-Z0-9]*));?")
+_HTML_ENTITIES = {name.rstrip(";"): char for name, char in html.entities.html5.items()}
+# Opening tag of the body, where a header-only read stops
+_TEXT_TAG_RE = re.compile(r"<text[\s/>]", re.IGNORECASE)
+_HEADER_BLOCK_SIZE = 4096
+_DOUBLE_UNDERSCORE_RE = re.compile(r"_[^\s_]*_")
+_ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+# Elements that html.parser based BeautifulSoup closes as soon as they are opened
+_VOID_TAGS = {
+    "area",
+    "base",
+    "br",
+    "col",
+    "embed",
+    "hr",
+    "img",
+    "input",
+    "link",
+    "meta",
+    "param",
+    "source",
+    "track",
+    "wbr",
+}
 logger = datasets.utils.logging.get_logger(__name__)
 
 
+@dataclass
+class CLMETConfig(datasets.BuilderConfig):
+    """BuilderConfig for CLMET_3_1. The filters are matched against the header of
+    every document, which is read up to the opening <text> tag, so the body of the
+    documents that do not match is never read or parsed
+
+    Args:
+        periods: periods of the documents to keep, e.g. ["1780-1850"]
+        genres: genres of the documents to keep, e.g. ["Narrative fiction"]
+        subgenres: subgenres of the documents to keep
+        decades: decades of the documents to keep, e.g. ["1800s"]
+        window_size: maximum number of tokens of the "windows" config
+        token_vocab_path: for the class and pos configs, store the tokens as uint32
+            `token_ids` instead of strings. The ids index the corpus vocabulary, which
+            is collected during generation and written to this path, one token per
+            line, see `load_token_vocab`. Every token is written before the first
+            example that uses it, so the ids of the examples generated so far can be
+            decoded, also when streaming stops early. The documents are generated in
+            a single process so that the ids are consistent. A reload from the cache
+            does not generate, so the file must be kept along with the cache
+    """
+
+    periods: Optional[List[str]] = None
+    genres: Optional[List[str]] = None
+    subgenres: Optional[List[str]] = None
+    decades: Optional[List[str]] = None
+    window_size: int = 512
+    token_vocab_path: Optional[str] = None
+
+
+def load_token_vocab(vocab_path):
+    """Returns the tokens of a vocabulary written with token_vocab_path, indexed by id"""
+    with open(vocab_path, "r", encoding="utf-8") as fp:
+        return fp.read().split("\n")[:-1]
+
+
 class CLMET_3_1(datasets.GeneratorBasedBuilder):
     """"""
 
     VERSION = datasets.Version("3.1.0")
 
+    BUILDER_CONFIG_CLASS = CLMETConfig
+
     BUILDER_CONFIGS = [
-        datasets.BuilderConfig(
+        CLMETConfig(
             name="plain",
             version=VERSION,
             description="This format contains text as single string and the classifications",
         ),
-        datasets.BuilderConfig(
+        CLMETConfig(
             name="class",
             version=VERSION,
             description="This format contains the text as a list of tokens, annotated according to the simplified Oxford wordclass tags",
         ),
-        datasets.BuilderConfig(
+        CLMETConfig(
             name="pos",
             version=VERSION,
             description="This format contains the text as a list of tokens, annotated according to the Penn Treebank POS tags",
         ),
+        CLMETConfig(
+            name="all",
+            version=VERSION,
+            description="This format contains the plain text as well as the list of tokens, annotated according to both the simplified Oxford wordclass tags and the Penn Treebank POS tags",
+        ),
+        CLMETConfig(
+            name="windows",
+            version=VERSION,
+            description="This format contains the tokens of the texts packed in windows of at most window_size tokens, which end on sentence boundaries where possible",
+        ),
     ]
 
     DEFAULT_CONFIG_NAME = "plain"
@@ -159,7 +277,7 @@ class CLMET_3_1(datasets.GeneratorBasedBuilder):
             features = datasets.Features(
                 {
                     "text": datasets.Sequence(datasets.Value("string")),
-                    "pos_tags": datasets.Sequence(datasets.Value("int32")),
+                    "pos_tags": datasets.Sequence(datasets.Value("int8")),
                     "genre": datasets.Value("string"),
                     "subgenre": datasets.Value("string"),
                     "year": datasets.Value("string"),
@@ -178,7 +296,7 @@ class CLMET_3_1(datasets.GeneratorBasedBuilder):
             features = datasets.Features(
                 {
                     "text": datasets.Sequence(datasets.Value("string")),
-                    "pos_tags": datasets.Sequence(datasets.Value("int32")),
+                    "pos_tags": datasets.Sequence(datasets.Value("int8")),
                     "genre": datasets.Value("string"),
                     "subgenre": datasets.Value("string"),
                     "year": datasets.Value("string"),
@@ -192,6 +310,46 @@ class CLMET_3_1(datasets.GeneratorBasedBuilder):
                     "id": datasets.Value("string"),
                 }
             )
+        elif self.config.name == "all":
+            logger.warn(f"CLASS tags are as follows: {_CLASS_LIST}")
+            logger.warn(f"POS tags are as follows: {_POS_LIST}")
+            features = datasets.Features(
+                {
+                    "text": datasets.Value("string"),
+                    "tokens": datasets.Sequence(datasets.Value("string")),
+                    "class_tags": datasets.Sequence(datasets.Value("int8")),
+                    "pos_tags": datasets.Sequence(datasets.Value("int8")),
+                    "genre": datasets.Value("string"),
+                    "subgenre": datasets.Value("string"),
+                    "year": datasets.Value("string"),
+                    "quarter_cent": datasets.Value("string"),
+                    "decade": datasets.Value("string"),
+                    "title": datasets.Value("string"),
+                    "author": datasets.Value("string"),
+                    "notes": datasets.Value("string"),
+                    "comments": datasets.Value("string"),
+                    "period": datasets.Value("string"),
+                    "id": datasets.Value("string"),
+                }
+            )
+        elif self.config.name == "windows":
+            features = datasets.Features(
+                {
+                    "id": datasets.Value("string"),
+                    "document_id": datasets.Value("string"),
+                    "tokens": datasets.Sequence(datasets.Value("string")),
+                    "text": datasets.Value("string"),
+                    "char_start": datasets.Value("int32"),
+                    "char_end": datasets.Value("int32"),
+                }
+            )
+        if self.config.token_vocab_path is not None:
+            if self.config.name not in ["class", "pos"]:
+                raise ValueError(
+                    f"token_vocab_path is only supported by the class and pos configs, not {self.config.name}"
+                )
+            del features["text"]
+            features["token_ids"] = datasets.Sequence(datasets.Value("uint32"))
         return datasets.DatasetInfo(
             description=_DESCRIPTION,
             features=features,
@@ -202,91 +360,425 @@ class CLMET_3_1(datasets.GeneratorBasedBuilder):
 
     def _split_generators(self, dl_manager):
         urls = _URLS[_DATASETNAME]
-        data_dir = dl_manager.download_and_extract(urls)
-        data_dir = os.path.join(data_dir, "clmet", "corpus", "txt")
+        archive = dl_manager.download(urls)
+        if dl_manager.is_streaming:
+            # Members can only be read in the order of the archive
+            files = dl_manager.iter_archive(archive)
+        else:
+            # Member names are read straight out of the archive, so the list can be sharded
+            # and nothing is extracted. Sorted so that the order of the examples is stable
+            files = self.list_members(archive)
+            if self.config.token_vocab_path is not None:
+                # Token ids are assigned as the tokens are first seen, a tuple is not sharded
+                files = tuple(files)
         return [
             datasets.SplitGenerator(
                 name=datasets.Split.TRAIN,
                 # These kwargs will be passed to _generate_examples
                 gen_kwargs={
-                    "data_dir": data_dir,
+                    "files": files,
+                    "archive": None if dl_manager.is_streaming else archive,
                     "split": "train",
                 },
             ),
         ]
 
-    def parse_pos_text(self, content_parts, pos_type):
-        tokens = []
-        pos_tags = []
-        unknown_tag = False
-        malformed_token = False
-        for content_part in content_parts:
-            text = content_part.text.strip()
-            for text_part in text.split():
-                try:
-                    token, pos_tag = text_part.split("_")
-                    pos_tag = pos_tag.replace("\n", "").strip().upper()
-                    if pos_type == "pos":
-                        pos_tag_idx = _POS_LOOKUP.get(pos_tag,-1)
+    def member_format(self, path):
+        """Returns the format directory of an archive member, None outside of the corpus"""
+        directory, file = posixpath.split(path)
+        format_dir, name = posixpath.split(directory)
+        if format_dir != _TXT_DIR or not file:
+            return None
+        return name
+
+    def source_format(self):
+        """Returns the format directory the config is generated from"""
+        return "pos" if self.config.name == "windows" else self.config.name
+
+    def list_members(self, archive):
+        with zipfile.ZipFile(archive) as zf:
+            members = sorted(zf.namelist())
+        if self.config.name != "all":
+            return [path for path in members if self.member_format(path) == self.source_format()]
+        # The three formats hold the same documents under the same file names
+        return [
+            tuple(posixpath.join(_TXT_DIR, name, posixpath.basename(path)) for name in _FORMATS)
+            for path in members
+            if self.member_format(path) == "plain"
+        ]
+
+    def iter_documents(self, files, archive):
+        """Yields the binary file objects of every document: its member in the selected
+        format, or for the "all" config its (plain, class, pos) members"""
+        if archive is not None:
+            with zipfile.ZipFile(archive) as zf:
+                for file in files:
+                    if self.config.name == "all":
+                        yield tuple(zf.open(path) for path in file)
                     else:
-                        pos_tag_idx = _CLASS_LOOKUP.get(pos_tag,-1)
-                    if pos_tag_idx==-1:
-                        unknown_tag = True
-                    tokens.append(token)
-                    pos_tags.append(pos_tag_idx)
-                except Exception as e:
-                    malformed_token = True
-        return tokens, pos_tags, unknown_tag, malformed_token
-
-    def parse_file(self, file, pos_type):
-        with open(file, "r", encoding="utf-8") as fp:
-            soup = BeautifulSoup(fp, features="html.parser")
-            id = soup.id.text
-            period = soup.period.text
-            quarter_cent = soup.quartcent.text
-            decade = soup.decade.text
-            year = soup.year.text
-            genre = soup.genre.text
-            subgenre = soup.subgenre.text
-            title = soup.title.text
-            notes = soup.notes.text
-            comments = soup.comments.text
-            author = soup.author.text
-            data_point = {
-                "id": id,
-                "period": period,
-                "genre": genre,
-                "subgenre": subgenre,
-                "decade": decade,
-                "quarter_cent": quarter_cent,
-                "title": title,
-                "notes": notes if notes else "",
-                "comments": comments if comments else "",
-                "author": author,
-                "year": year,
+                        yield zf.open(file)
+        elif self.config.name != "all":
+            for path, fp in files:
+                if self.member_format(path) == self.source_format():
+                    yield fp
+        else:
+            # When streaming, the members of a document are paired as they come. The zip
+            # members are read through the central directory, so the file objects of the
+            # ones whose counterparts are further in the archive stay readable and are
+            # held unread: no content is kept in memory while a document waits
+            pending = {}
+            for path, fp in files:
+                name = self.member_format(path)
+                if name not in _FORMATS:
+                    continue
+                document = pending.setdefault(posixpath.basename(path), {})
+                document[name] = fp
+                if len(document) == len(_FORMATS):
+                    del pending[posixpath.basename(path)]
+                    yield tuple(document[name] for name in _FORMATS)
+
+    def decode_charref(self, match):
+        number, name = match.groups()
+        if number is not None:
+            return html.unescape(f"&#{number};")
+        return _HTML_ENTITIES.get(name, "&" + name)
+
+    def decode_data(self, data, decoded=""):
+        """Decodes character references and, like BeautifulSoup, collapses strings
+        made only of whitespace to a single newline or space. decoded is the start
+        of the string, already decoded"""
+        if "&" in data:
+            data = _CHARREF_RE.sub(self.decode_charref, data)
+        if decoded:
+            data = decoded + data
+        if data.strip(_ASCII_SPACES):
+            return data
+        return "\n" if "\n" in data else " "
+
+    def scan_markup(self, content, header_tags=_HEADER_TAGS):
+        """Single pass over the markup of a CLMET file, returning the text of the first
+        element of every tag in header_tags and of every <p> inside the first <text> element.
+        Texts match the .text of the corresponding BeautifulSoup html.parser elements,
+        which leave out the content of script and style elements and keep the content
+        of CDATA sections. The only known differences are on files cut off inside
+        markup or a character reference, which CLMET files, ending with </text>, are not"""
+        header = {}
+        paragraphs = []
+        stack = []
+        capturing = []
+        # Decoded pieces of the current string, when markup that html.parser passes
+        # over without ending the string (</>, unterminated comments) splits it
+        pieces = []
+        text_state = "before"
+        # Depth of the first <text> element in the stack, which only its own end
+        # tag (or the end tag of an element containing it) closes
+        text_depth = None
+        pos = 0
+        while True:
+            match = _MARKUP_RE.search(content, pos)
+            if match is None:
+                break
+            start = match.start()
+            name, attrs, closing, bogus_closing, cdata, passed_over = match.groups()
+            if passed_over is not None:
+                if capturing:
+                    if start > pos:
+                        pieces.append(_CHARREF_RE.sub(self.decode_charref, content[pos:start]))
+                    if passed_over != "/>":
+                        pieces.append(match.group())
+                pos = match.end()
+                continue
+            if capturing and (start > pos or pieces):
+                data = self.decode_data(content[pos:start], "".join(pieces))
+                pieces = []
+                for buffer in capturing:
+                    buffer.append(data)
+            pos = match.end()
+            if cdata is not None:
+                # A string of its own, without character references
+                if capturing:
+                    data = self.decode_data("", cdata)
+                    for buffer in capturing:
+                        buffer.append(data)
+                continue
+            if name is None:
+                closing = closing or bogus_closing
+                if closing is None:
+                    continue
+                closing = closing.lower()
+                for idx in range(len(stack) - 1, -1, -1):
+                    if stack[idx][0] == closing:
+                        # capturing holds the buffers of the stack in the same order,
+                        # so the closed elements own the last ones
+                        closed_buffers = 0
+                        for _, buffer in stack[idx:]:
+                            closed_buffers += buffer is not None
+                        if text_state == "open" and idx <= text_depth:
+                            text_state = "closed"
+                        del capturing[len(capturing) - closed_buffers :]
+                        del stack[idx:]
+                        break
+                continue
+            name = name.lower()
+            buffer = None
+            if name in header_tags and name not in header:
+                buffer = header[name] = []
+            elif name == "p" and text_state == "open":
+                buffer = []
+                paragraphs.append(buffer)
+            elif name == "text" and text_state == "before":
+                text_state = "opening"
+            if name in _VOID_TAGS or attrs.endswith("/"):
+                if text_state == "opening":
+                    text_state = "closed"
+                continue
+            if name in _RAW_TEXT_END_RES:
+                # Opened and closed at once, without text. Without an end tag,
+                # html.parser drops the rest of the file
+                end = _RAW_TEXT_END_RES[name].search(content, pos)
+                pos = end.end() if end else len(content)
+                continue
+            if text_state == "opening":
+                text_state = "open"
+                text_depth = len(stack)
+            stack.append((name, buffer))
+            if buffer is not None:
+                capturing.append(buffer)
+        if capturing and (pos < len(content) or pieces):
+            data = self.decode_data(content[pos:], "".join(pieces))
+            for buffer in capturing:
+                buffer.append(data)
+        header = {name: "".join(buffer) for name, buffer in header.items()}
+        return header, ["".join(buffer) for buffer in paragraphs]
+
+    def parse_pos_text(self, content_parts, pos_type):
+        """Splits all the paragraphs into tokens and tag ids in one batch. Returns the
+        tokens, the tag ids as an int8 array (-1 for unknown tags), and the number of
+        unknown tags and of malformed tokens (not exactly one "_"), which are skipped"""
+        text = "\n".join(content_parts)
+        text_parts = text.split()
+        malformed_tokens = 0
+        # As many underscores as parts and no part with two of them means that every
+        # part is well-formed, which saves counting the underscores part by part
+        if text.count("_") != len(text_parts) or _DOUBLE_UNDERSCORE_RE.search(text):
+            underscores = np.fromiter(
+                map(str.count, text_parts, repeat("_")),
+                dtype=np.int64,
+                count=len(text_parts),
+            )
+            well_formed = underscores == 1
+            malformed_tokens = len(text_parts) - int(np.count_nonzero(well_formed))
+            text_parts = list(compress(text_parts, well_formed))
+        if not text_parts:
+            return [], np.zeros(0, dtype=np.int8), 0, malformed_tokens
+        # Every part holds exactly one "_", so the pieces alternate token, tag
+        pieces = "\n".join(text_parts).replace("_", "\n").split("\n")
+        tokens = pieces[0::2]
+        pos_tags = "\n".join(pieces[1::2]).upper().split("\n")
+        lookup = _POS_LOOKUP if pos_type == "pos" else _CLASS_LOOKUP
+        pos_tags = np.fromiter(
+            map(lookup.get, pos_tags, repeat(-1)), dtype=np.int8, count=len(pos_tags)
+        )
+        unknown_tags = int(np.count_nonzero(pos_tags == -1))
+        return tokens, pos_tags, unknown_tags, malformed_tokens
+
+    def header_filters(self):
+        filters = {
+            "period": self.config.periods,
+            "genre": self.config.genres,
+            "subgenre": self.config.subgenres,
+            "decade": self.config.decades,
+        }
+        return {
+            name: {value.strip() for value in values}
+            for name, values in filters.items()
+            if values is not None
+        }
+
+    def read_document(self, file, filters):
+        """Returns the content of a binary file object, or None when its header does not
+        match the filters. Only the header, up to the opening <text> tag, is read for that"""
+        with io.TextIOWrapper(file, encoding="utf-8") as fp:
+            if not filters:
+                return fp.read()
+            head = ""
+            match = None
+            while match is None:
+                block = fp.read(_HEADER_BLOCK_SIZE)
+                if not block:
+                    break
+                # The tag may straddle two blocks
+                start = max(len(head) - 5, 0)
+                head += block
+                match = _TEXT_TAG_RE.search(head, start)
+            header, _ = self.scan_markup(head[: match.start()] if match else head)
+            for name, values in filters.items():
+                if header.get(name, "").strip() not in values:
+                    return None
+            return head + fp.read()
+
+    def parse_header(self, header):
+        id = header["id"]
+        period = header["period"]
+        quarter_cent = header["quartcent"]
+        decade = header["decade"]
+        year = header["year"]
+        genre = header["genre"]
+        subgenre = header["subgenre"]
+        title = header["title"]
+        notes = header["notes"]
+        comments = header["comments"]
+        author = header["author"]
+        data_point = {
+            "id": id,
+            "period": period,
+            "genre": genre,
+            "subgenre": subgenre,
+            "decade": decade,
+            "quarter_cent": quarter_cent,
+            "title": title,
+            "notes": notes if notes else "",
+            "comments": comments if comments else "",
+            "author": author,
+            "year": year,
+        }
+        return data_point
+
+    def parse_file(self, content, pos_type):
+        header, content_parts = self.scan_markup(content)
+        id = header["id"]
+        data_point = self.parse_header(header)
+
+        if pos_type in ["pos", "class"]:
+            tagged = self.parse_pos_text(content_parts, pos_type)
+            if tagged[2]:
+                logger.warn(f'{tagged[2]} unknown tags in sample {id}')
+            if tagged[3]:
+                logger.warn(f'{tagged[3]} malformed tokens in sample {id}')
+            data_point["text"] = tagged[0]
+            data_point["pos_tags"] = tagged[1]
+        else:
+            data_point["text"] = " ".join(content_parts)
+        return (id, data_point)
+
+    def parse_all_files(self, content, class_file, pos_file):
+        """Joins the three formats of a document, given the content of its plain file
+        and the binary file objects of the tagged ones.
+        The header is only decoded from the plain file, the tagged files are scanned
+        for their paragraphs alone"""
+        header, content_parts = self.scan_markup(content)
+        id = header["id"]
+        data_point = self.parse_header(header)
+        data_point["text"] = " ".join(content_parts)
+        for pos_type, file in [("class", class_file), ("pos", pos_file)]:
+            with io.TextIOWrapper(file, encoding="utf-8") as fp:
+                _, content_parts = self.scan_markup(fp.read(), header_tags=())
+            tokens, pos_tags, unknown_tags, malformed_tokens = self.parse_pos_text(content_parts, pos_type)
+            if unknown_tags:
+                logger.warn(f'{unknown_tags} unknown {pos_type} tags in sample {id}')
+            if malformed_tokens:
+                logger.warn(f'{malformed_tokens} malformed {pos_type} tokens in sample {id}')
+            if "tokens" not in data_point:
+                data_point["tokens"] = tokens
+            elif tokens != data_point["tokens"]:
+                logger.warn(f'Class and POS tokens differ in sample {id}')
+            data_point[f"{pos_type}_tags"] = pos_tags
+        return (id, data_point)
+
+    def pack_windows(self, pos_tags, window_size):
+        """Returns the (start, end) token ranges of the windows of a document. Every
+        window ends after the last SENT tag that fits in it, or is cut at window_size
+        tokens when a sentence is longer than that"""
+        sentence_ends = np.flatnonzero(pos_tags == _POS_LOOKUP["SENT"]) + 1
+        windows = []
+        start = 0
+        while start < len(pos_tags):
+            end = start + window_size
+            if end < len(pos_tags):
+                idx = np.searchsorted(sentence_ends, end, side="right")
+                if idx and sentence_ends[idx - 1] > start:
+                    end = int(sentence_ends[idx - 1])
+            else:
+                end = len(pos_tags)
+            windows.append((start, end))
+            start = end
+        return windows
+
+    def parse_windows(self, content):
+        """Yields the token windows of the pos file of a document. The character
+        offsets are into the text of the document with its tokens joined by spaces"""
+        if self.config.window_size < 1:
+            raise ValueError(f"window_size must be positive, got {self.config.window_size}")
+        header, content_parts = self.scan_markup(content)
+        id = header["id"]
+        tokens, pos_tags, unknown_tags, malformed_tokens = self.parse_pos_text(content_parts, "pos")
+        if unknown_tags:
+            logger.warn(f'{unknown_tags} unknown tags in sample {id}')
+        if malformed_tokens:
+            logger.warn(f'{malformed_tokens} malformed tokens in sample {id}')
+        if not tokens:
+            return
+        token_ends = np.cumsum(np.fromiter(map(len, tokens), dtype=np.int64, count=len(tokens)) + 1) - 1
+        for idx, (start, end) in enumerate(self.pack_windows(pos_tags, self.config.window_size)):
+            window_tokens = tokens[start:end]
+            char_end = int(token_ends[end - 1])
+            yield f"{id}_{idx}", {
+                "id": f"{id}_{idx}",
+                "document_id": id,
+                "tokens": window_tokens,
+                "text": " ".join(window_tokens),
+                "char_start": int(token_ends[start - 1]) + 1 if start else 0,
+                "char_end": char_end,
             }
-            content_parts = soup.find("text").find_all("p")
-
-            if pos_type in ["pos", "class"]:
-                content = self.parse_pos_text(content_parts, pos_type)
-                if content[2]:
-                    logger.warn(f'Unknown tag in sample {id}')
-                if content[3]:
-                    logger.warn(f'Malformed token in sample {id}')
-                data_point["text"] = content[0]
-                data_point["pos_tags"] = content[1]
+
+    def encode_tokens(self, tokens, vocab, vocab_file):
+        """Returns the ids of the tokens as a uint32 array. The new tokens are added to
+        vocab and written to vocab_file before their ids are returned"""
+        new_tokens = [token for token in dict.fromkeys(tokens) if token not in vocab]
+        if new_tokens:
+            for token in new_tokens:
+                vocab[token] = len(vocab)
+            vocab_file.writelines(token + "\n" for token in new_tokens)
+            vocab_file.flush()
+        return np.fromiter(map(vocab.__getitem__, tokens), dtype=np.uint32, count=len(tokens))
+
+    def open_token_vocab(self):
+        vocab_path = self.config.token_vocab_path
+        if os.path.dirname(vocab_path):
+            os.makedirs(os.path.dirname(vocab_path), exist_ok=True)
+        return open(vocab_path, "w", encoding="utf-8")
+
+    def _generate_examples(self, files, archive, split):
+        filters = self.header_filters()
+        vocab, vocab_file = None, None
+        if self.config.token_vocab_path is not None:
+            vocab, vocab_file = {}, self.open_token_vocab()
+        try:
+            yield from self.generate_documents(files, archive, filters, vocab, vocab_file)
+        finally:
+            if vocab_file is not None:
+                vocab_file.close()
+                logger.info(f"Wrote {len(vocab)} tokens to {self.config.token_vocab_path}")
+
+    def generate_documents(self, files, archive, filters, vocab, vocab_file):
+        """Yields the examples of the documents, with their tokens encoded when vocab is set"""
+        for file in self.iter_documents(files, archive):
+            if self.config.name == "all":
+                plain_file, class_file, pos_file = file
+                content = self.read_document(plain_file, filters)
+                if content is None:
+                    class_file.close()
+                    pos_file.close()
+                    continue
+                id, data = self.parse_all_files(content, class_file, pos_file)
             else:
-                content = []
-                for content_part in content_parts:
-                    content.append(content_part.text)
-                content = " ".join(content)
-                data_point["text"] = content
-            return (id, data_point)
-
-    def _generate_examples(self, data_dir, split):
-        final_data_dir = os.path.join(data_dir, self.config.name)
-        for file in os.listdir(final_data_dir):
-            id, data = self.parse_file(
-                os.path.join(final_data_dir, file), self.config.name
-            )
+                content = self.read_document(file, filters)
+                if content is None:
+                    continue
+                if self.config.name == "windows":
+                    yield from self.parse_windows(content)
+                    continue
+                id, data = self.parse_file(content, self.config.name)
+                if vocab is not None:
+                    data["token_ids"] = self.encode_tokens(data.pop("text"), vocab, vocab_file)
             yield id, data
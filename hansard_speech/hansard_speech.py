@@ -15,11 +15,22 @@
 A dataset containing every speech in the House of Commons from May 1979-July 2020.
 """
 
+import hashlib
+import io
 import json
 import os
+import sqlite3
 import time
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from dataclasses import dataclass, field
 from datetime import datetime
+from typing import List, Optional
 import datasets
 
 _CITATION = """@misc{odell, evan_2021, 
@@ -46,6 +57,45 @@ _URLS = {
     "json": "https://zenodo.org/record/4843485/files/parliamentary_posts.json?download=1",
 }
 
+_CSV_FILENAME = "hansard-speeches-v310.csv"
+
+# Target size of the record-aligned byte ranges the CSV is cut into while it is read
+_SHARD_SIZE = 64 * 1024 * 1024
+_READ_BLOCK_SIZE = 1024 * 1024
+# Number of CSV records in the chunks a shard is parsed and checkpointed in
+_CHUNK_SIZE = 50000
+
+# Key holding the post name in the items of each posts column of the JSON
+_POST_NAME_KEYS = {
+    "parliamentary_posts": "parl_post_name",
+    "government_posts": "gov_post_name",
+    "opposition_posts": "opp_post_name",
+}
+
+# Dates are stored as days since 0001-01-01, keyed as mnis_id * _DAY_SPAN + day
+_EPOCH_ORDINAL = 719163
+_DAY_SPAN = 1 << 22
+
+# Low-cardinality columns that can be stored as ClassLabel ids
+_CATEGORICAL_FIELDS = [
+    "display_as",
+    "party",
+    "constituency",
+    "speech_class",
+    "major_heading",
+]
+
+# Config settings that change the generated tables, and so key the checkpoints
+_CHECKPOINT_SETTINGS = [
+    "start_year",
+    "end_year",
+    "parties",
+    "speech_classes",
+    "columns",
+    "encode_categoricals",
+    "posts_max_gap_days",
+]
+
 fields = [
     "id",
     "speech",
@@ -74,11 +124,252 @@ fields = [
 logger = datasets.utils.logging.get_logger(__name__)
 
 
-class HansardSpeech(datasets.GeneratorBasedBuilder):
+@dataclass
+class HansardSpeechConfig(datasets.BuilderConfig):
+    """BuilderConfig for HansardSpeech. The filters are applied to every CSV chunk
+    before it is converted, so only the matching speeches are joined and written
+
+    Args:
+        start_year: first year (inclusive) of speeches to keep
+        end_year: last year (inclusive) of speeches to keep
+        parties: parties of the speakers to keep, e.g. ["Conservative"]
+        speech_classes: speech classes to keep, e.g. ["Speech"]
+        columns: CSV columns to keep, all of them if None. Only these columns
+            (plus the ones needed for the filters and the posts lookup) are read
+        encode_categoricals: store the low-cardinality string columns and the
+            post names as ClassLabel ids. The vocabularies are collected in a
+            pre-scan of the data and exposed as the ClassLabel names. Not supported
+            with streaming=True, where the pre-scan would be a full extra pass over
+            the remote archive
+        checkpoint_dir: directory where every completed CSV chunk is saved, so
+            that an interrupted build resumes from the last completed chunk of
+            each shard. It can be deleted once the build has finished
+        fts_index_path: path of an SQLite FTS5 full-text index of the speeches,
+            keyed by speech id with date, party and display_as as filterable
+            columns. It is filled during generation, see `search_speeches`
+        num_workers: number of processes converting the shards of the CSV. The CSV
+            is read in a single pass here and its ~64MB shards are handed to the
+            workers, with at most two shards per worker in flight. The tables keep
+            the order of the CSV, so the worker count is left out of the config id
+            and every num_workers shares the same cache
+        posts_max_gap_days: number of days after a record of parliamentary_posts.json
+            during which its posts still apply to the speeches of the member, unless
+            a newer record of the member starts earlier. With the default of 0, a
+            speech only gets the posts of a record with the exact same date
+    """
+
+    start_year: Optional[int] = None
+    end_year: Optional[int] = None
+    parties: Optional[List[str]] = None
+    speech_classes: Optional[List[str]] = None
+    columns: Optional[List[str]] = None
+    encode_categoricals: bool = False
+    checkpoint_dir: Optional[str] = None
+    fts_index_path: Optional[str] = None
+    num_workers: int = field(default=1, compare=False)
+    posts_max_gap_days: int = 0
+
+    def create_config_id(self, config_kwargs, custom_features=None):
+        config_kwargs = {key: value for key, value in config_kwargs.items() if key != "num_workers"}
+        return super().create_config_id(config_kwargs, custom_features=custom_features)
+
+
+def search_speeches(
+    index_path,
+    query,
+    party=None,
+    display_as=None,
+    start_date=None,
+    end_date=None,
+    limit=100,
+):
+    """Returns the ids of the speeches matching an FTS5 query (e.g. '"climate change"'
+    or 'fishing AND quota'), best matches first, from an index built with fts_index_path.
+    Dates are compared as YYYY-MM-DD strings and both ends are inclusive"""
+    conditions = ["speeches_fts MATCH ?"]
+    params = [query]
+    for condition, value in [
+        ("speeches.party = ?", party),
+        ("speeches.display_as = ?", display_as),
+        ("speeches.date >= ?", start_date),
+        ("speeches.date <= ?", end_date),
+    ]:
+        if value is not None:
+            conditions.append(condition)
+            params.append(value)
+    params.append(limit)
+    with sqlite3.connect(index_path) as conn:
+        rows = conn.execute(
+            "SELECT speeches.id FROM speeches_fts "
+            "JOIN speeches ON speeches.rowid = speeches_fts.rowid "
+            f"WHERE {' AND '.join(conditions)} ORDER BY speeches_fts.rank LIMIT ?",
+            params,
+        ).fetchall()
+    return [row[0] for row in rows]
+
+
+def _iter_json_records(fp, block_size=_READ_BLOCK_SIZE):
+    """Yields the objects of a top-level JSON array one at a time, reading the file
+    in blocks so that the whole document is never held in memory"""
+    decoder = json.JSONDecoder()
+    buffer = fp.read(block_size).lstrip()
+    if not buffer.startswith("["):
+        raise ValueError("Expected a JSON array of records")
+    pos = 1
+    while True:
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == "]":
+            return
+        try:
+            record, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            block = fp.read(block_size)
+            if not block:
+                raise
+            buffer = buffer[pos:] + block
+            pos = 0
+            continue
+        yield record
+
+
+class _PostsIndex:
+    """Interval index over parliamentary_posts.json. Every record of a member opens
+    an interval that lasts max_gap_days, or until that member's next record if it
+    comes sooner, so the posts held on a date are the ones of the latest record on or
+    before it within that gap. The records are kept as flat sorted numpy arrays, so
+    lookups are binary searches and the index can be shared read-only between worker
+    processes"""
+
+    def __init__(self, keys, post_offsets, post_ids, post_names):
+        self.keys = keys
+        self.post_offsets = post_offsets
+        self.post_ids = post_ids
+        self.post_names = post_names
+        self.post_names_array = pa.array(post_names, type=pa.string())
+
+    @classmethod
+    def from_records(cls, records):
+        """Builds the index from an iterable of JSON records, one record at a time"""
+        keys = array("q")
+        post_lengths = {column: array("q") for column in _POST_NAME_KEYS}
+        post_ids = {column: array("i") for column in _POST_NAME_KEYS}
+        name_ids = {}
+        for record in records:
+            day = datetime.fromisoformat(record["date"][:10]).toordinal()
+            keys.append(int(record["mnis_id"]) * _DAY_SPAN + day)
+            for column, name_key in _POST_NAME_KEYS.items():
+                items = record.get(column) or []
+                post_lengths[column].append(len(items))
+                post_ids[column].extend(
+                    name_ids.setdefault(item[name_key], len(name_ids))
+                    for item in items
+                )
+        keys = np.frombuffer(keys, dtype=np.int64)
+        if not len(keys):
+            empty = {column: np.zeros(1, dtype=np.int64) for column in _POST_NAME_KEYS}
+            ids = {column: np.zeros(0, dtype=np.int32) for column in _POST_NAME_KEYS}
+            return cls(keys, empty, ids, [])
+        # Sort by member and date, keeping only the first record of duplicate keys
+        order = np.argsort(keys, kind="stable")
+        order = order[np.r_[True, keys[order][1:] != keys[order][:-1]]]
+        sorted_offsets, sorted_ids = {}, {}
+        for column in _POST_NAME_KEYS:
+            lengths = np.frombuffer(post_lengths[column], dtype=np.int64)
+            offsets = np.r_[0, np.cumsum(lengths)]
+            ids = np.frombuffer(post_ids[column], dtype=np.int32)
+            starts, lengths = offsets[order], lengths[order]
+            sorted_offsets[column] = np.r_[0, np.cumsum(lengths)]
+            sorted_ids[column] = ids[cls.ranges(starts, lengths)]
+        return cls(keys[order], sorted_offsets, sorted_ids, list(name_ids))
+
+    @staticmethod
+    def ranges(starts, lengths):
+        """Concatenation of the ranges [start, start + length)"""
+        ends = np.cumsum(lengths)
+        return np.arange(ends[-1] if len(ends) else 0) + np.repeat(
+            starts - (ends - lengths), lengths
+        )
+
+    def lookup(self, mnis_ids, dates, max_gap_days=0):
+        """Posts held by each member on each date, as a list array per posts column.
+        A record only applies to the dates at most max_gap_days after its own"""
+        if not len(self.keys):
+            no_posts = pa.array([[]] * len(mnis_ids), type=pa.list_(pa.string()))
+            return {column: no_posts for column in self.post_offsets}
+        members = pd.to_numeric(mnis_ids, errors="coerce")
+        days = pd.to_datetime(dates, format="%Y-%m-%d", errors="coerce")
+        valid = (members.notna() & days.notna()).to_numpy()
+        members = members.fillna(0).to_numpy().astype(np.int64)
+        days = (days - pd.Timestamp(0)).dt.days.fillna(0).to_numpy().astype(np.int64)
+        queries = members * _DAY_SPAN + days + _EPOCH_ORDINAL
+        matches = np.searchsorted(self.keys, queries, side="right") - 1
+        found = valid & (matches >= 0)
+        matches = np.where(found, matches, 0)
+        found &= self.keys[matches] // _DAY_SPAN == members
+        found &= queries - self.keys[matches] <= max_gap_days
+        posts = {}
+        for column, offsets in self.post_offsets.items():
+            starts = np.where(found, offsets[matches], 0)
+            lengths = np.where(found, offsets[matches + 1] - starts, 0)
+            values = self.post_names_array.take(
+                pa.array(self.post_ids[column][self.ranges(starts, lengths)])
+            )
+            posts[column] = pa.ListArray.from_arrays(
+                pa.array(np.r_[0, np.cumsum(lengths)], type=pa.int32()), values
+            )
+        return posts
+
+
+_worker_state = {}
+
+
+def _init_worker(builder, posts_index):
+    """Keeps the builder and the posts index of a pool worker process, which opens its
+    own connection to the full-text index"""
+    _worker_state["builder"] = builder
+    _worker_state["posts_index"] = posts_index
+    _worker_state["fts_index"] = None
+    if builder.config.fts_index_path is not None:
+        _worker_state["fts_index"] = builder.open_fts_index()
+
+
+def _convert_shard(column_names, content, completed_chunks):
+    """Converts a shard read by the parent process, in a pool worker"""
+    return list(
+        _worker_state["builder"].convert_shard(
+            column_names,
+            content,
+            _worker_state["posts_index"],
+            _worker_state["fts_index"],
+            completed_chunks,
+        )
+    )
+
+
+class HansardSpeech(datasets.ArrowBasedBuilder):
     """A dataset containing every speech in the House of Commons from May 1979-July 2020."""
 
     VERSION = datasets.Version("3.1.0")
 
+    BUILDER_CONFIG_CLASS = HansardSpeechConfig
+
+    BUILDER_CONFIGS = [
+        HansardSpeechConfig(
+            name="default",
+            version=VERSION,
+            description="Every speech with its full text, speaker metadata and posts",
+        ),
+        HansardSpeechConfig(
+            name="metadata",
+            version=VERSION,
+            description="Speaker, party, date, headings and posts of every speech, without the speech text",
+            columns=[field for field in fields[:-3] if field != "speech"],
+        ),
+    ]
+
+    DEFAULT_CONFIG_NAME = "default"
+
     def _info(self):
         features = datasets.Features(
             {
@@ -106,6 +397,13 @@ class HansardSpeech(datasets.GeneratorBasedBuilder):
                 "parliamentary_posts": datasets.Sequence(datasets.Value("string")),
             }
         )
+        features = datasets.Features(
+            {
+                field: feature
+                for field, feature in features.items()
+                if field in self.selected_fields() or field in fields[-3:]
+            }
+        )
         return datasets.DatasetInfo(
             description=_DESCRIPTION,
             features=features,
@@ -114,48 +412,353 @@ class HansardSpeech(datasets.GeneratorBasedBuilder):
             citation=_CITATION,
         )
 
+    def selected_fields(self):
+        """CSV columns that end up in the examples"""
+        if self.config.columns is None:
+            return fields[:-3]
+        return [field for field in fields[:-3] if field in self.config.columns]
+
+    def fields_to_read(self):
+        """CSV columns needed for the examples, the filters and the posts lookup"""
+        needed = set(self.selected_fields()) | {"mnis_id", "date"}
+        if self.config.start_year is not None or self.config.end_year is not None:
+            needed.add("year")
+        if self.config.parties is not None:
+            needed.add("party")
+        if self.config.speech_classes is not None:
+            needed.add("speech_class")
+        if self.config.fts_index_path is not None:
+            needed |= {"id", "speech", "date", "party", "display_as"}
+        return [field for field in fields[:-3] if field in needed]
+
     def _split_generators(self, dl_manager):
-        temp_dir = dl_manager.download_and_extract(_URLS["csv"])
-        csv_file = os.path.join(temp_dir, "hansard-speeches-v310.csv")
+        archive = dl_manager.download(_URLS["csv"])
+        csv_files = dl_manager.iter_archive(archive)
         json_file = dl_manager.download(_URLS["json"])
+        if self.config.encode_categoricals:
+            if dl_manager.is_streaming:
+                raise ValueError(
+                    "encode_categoricals is not supported with streaming=True, "
+                    "its vocabularies need a full pass over the archive"
+                )
+            self.info.features = self.encode_features(
+                self.scan_vocabularies(csv_files, json_file)
+            )
         return [
             datasets.SplitGenerator(
                 name=datasets.Split.TRAIN,
-                # These kwargs will be passed to _generate_examples
-                gen_kwargs={"filepaths": [csv_file, json_file], "split": "train",},
+                # These kwargs will be passed to _generate_tables
+                gen_kwargs={
+                    "csv_files": csv_files,
+                    "json_file": json_file,
+                    "split": "train",
+                },
             ),
         ]
 
-    def _generate_examples(self, filepaths, split):
-        logger.warn("\nThis is a large dataset. Please be patient")
-        json_data = pd.read_json(filepaths[1])
-        csv_data_chunks = pd.read_csv(filepaths[0], chunksize=50000, dtype="object")
-        for data_chunk in csv_data_chunks:
-            data_chunk.fillna("", inplace=True)
-            for _, row in data_chunk.iterrows():
-                data_point = {}
-                for field in fields[:-3]:
-                    data_point[field] = str(row[field]) if row[field] else ""
-                parl_post_list = []
-                if data_point["mnis_id"] and data_point["date"]:
-                    speech_dt = data_point["date"] + " 00:00:00"
-                    try:
-                        parl_posts = json_data[
-                            (json_data["mnis_id"] == int(data_point["mnis_id"]))
-                            & (json_data["date"] == speech_dt)
-                        ]["parliamentary_posts"]
-                        if len(parl_posts) > 0:
-                            parl_posts = parl_posts.iloc[0]
-                            for item in parl_posts:
-                                parl_post_list.append(item["parl_post_name"])
-                    except Exception as e:
-                        logger.warn(
-                            f"Data could not be fetched for mnis_id: {data_point['mnis_id']}, date: {data_point['date']}\nError: {repr(e)}"
-                        )
-                opp_post = []
-                gov_post = []
-                data_point["government_posts"] = gov_post
-                data_point["opposition_posts"] = opp_post
-                data_point["parliamentary_posts"] = parl_post_list
-                yield data_point["id"], data_point
+    def scan_vocabularies(self, csv_files, json_file):
+        """Collects the sorted values of every categorical column and of the post names"""
+        categorical_fields = [
+            field for field in _CATEGORICAL_FIELDS if field in self.selected_fields()
+        ]
+        vocabularies = {field: set() for field in categorical_fields}
+        for _, _, column_names, content in self.iter_shards(csv_files):
+            for data_chunk in self.read_shard(
+                column_names, content, usecols=categorical_fields
+            ):
+                data_chunk = data_chunk.fillna("")
+                for field in categorical_fields:
+                    vocabularies[field].update(data_chunk[field].unique())
+        vocabularies["posts"] = self.build_posts_index(json_file).post_names
+        return {field: sorted(names) for field, names in vocabularies.items()}
+
+    def encode_features(self, vocabularies):
+        """Replaces the categorical string features with ClassLabel features"""
+        features = self.info.features.copy()
+        for field, names in vocabularies.items():
+            if field == "posts":
+                for posts_field in fields[-3:]:
+                    features[posts_field] = datasets.Sequence(
+                        datasets.ClassLabel(names=names)
+                    )
+            else:
+                features[field] = datasets.ClassLabel(names=names)
+        return features
+
+    def iter_shards(self, csv_files, shard_size=_SHARD_SIZE):
+        """Reads the CSV in a single pass, streaming it out of the archive without
+        extracting it, and yields (shard_idx, start, column_names, content) for byte
+        ranges of about shard_size that start and end on record boundaries. Speeches
+        can contain quoted newlines, so a newline only ends a record when an even
+        number of quotes has been seen since the start of the shard"""
+        for path, fp in csv_files:
+            if os.path.basename(path) != _CSV_FILENAME:
+                continue
+            header = fp.readline()
+            column_names = pd.read_csv(io.BytesIO(header), nrows=0).columns
+            shard_idx, start = 0, len(header)
+            buffer = bytearray()
+            # Quotes are counted up to pos, the position after the last newline seen
+            pos, odd_quotes = 0, False
+            while True:
+                block = fp.read(_READ_BLOCK_SIZE)
+                buffer += block
+                while True:
+                    end = None
+                    if not block:
+                        end = len(buffer) or None
+                    while end is None:
+                        newline = buffer.find(b"\n", max(shard_size, pos))
+                        if newline == -1:
+                            break
+                        odd_quotes ^= buffer.count(b'"', pos, newline) % 2 == 1
+                        pos = newline + 1
+                        if not odd_quotes:
+                            end = pos
+                    if end is None:
+                        break
+                    yield shard_idx, start, column_names, bytes(buffer[:end])
+                    del buffer[:end]
+                    shard_idx, start = shard_idx + 1, start + end
+                    pos, odd_quotes = 0, False
+                if not block:
+                    return
+        raise FileNotFoundError(f"{_CSV_FILENAME} not found in the archive")
+
+    def read_shard(self, column_names, content, usecols=None):
+        """Reads the records of a shard in chunks"""
+        return pd.read_csv(
+            io.BytesIO(content),
+            header=None,
+            names=column_names,
+            usecols=usecols if usecols is not None else self.fields_to_read(),
+            chunksize=_CHUNK_SIZE,
+            dtype="object",
+        )
+
+    def build_posts_index(self, json_file):
+        """Builds the interval index of the posts held by every member"""
+        with open(json_file, "r", encoding="utf-8") as fp:
+            return _PostsIndex.from_records(_iter_json_records(fp))
+
+    def filter_chunk(self, data_chunk):
+        """Drops the rows of the chunk that do not match the config filters"""
+        mask = pd.Series(True, index=data_chunk.index)
+        if self.config.start_year is not None or self.config.end_year is not None:
+            years = pd.to_numeric(data_chunk["year"], errors="coerce")
+            if self.config.start_year is not None:
+                mask &= years >= self.config.start_year
+            if self.config.end_year is not None:
+                mask &= years <= self.config.end_year
+        if self.config.parties is not None:
+            mask &= data_chunk["party"].isin(self.config.parties)
+        if self.config.speech_classes is not None:
+            mask &= data_chunk["speech_class"].isin(self.config.speech_classes)
+        return data_chunk[mask]
 
+    def encode_column(self, array, feature):
+        """Maps the strings of a column to the ids of its ClassLabel feature"""
+        if isinstance(feature, datasets.Sequence):
+            return pa.ListArray.from_arrays(
+                array.offsets, self.encode_column(array.flatten(), feature.feature)
+            )
+        value_set = pa.array(feature.names, type=pa.string())
+        return pc.index_in(array, value_set=value_set).cast(pa.int64())
+
+    def chunk_to_table(self, data_chunk, posts_index):
+        """Converts a chunk of the CSV into an Arrow table in one vectorized step"""
+        data_chunk = data_chunk.fillna("")
+        columns = {
+            field: pa.array(data_chunk[field].to_numpy(), type=pa.string())
+            for field in self.selected_fields()
+        }
+        columns.update(
+            posts_index.lookup(
+                data_chunk["mnis_id"], data_chunk["date"], self.config.posts_max_gap_days
+            )
+        )
+        if self.config.encode_categoricals:
+            for field, feature in self.info.features.items():
+                if isinstance(feature, datasets.ClassLabel) or (
+                    isinstance(feature, datasets.Sequence)
+                    and isinstance(feature.feature, datasets.ClassLabel)
+                ):
+                    columns[field] = self.encode_column(columns[field], feature)
+        return pa.Table.from_pydict(columns, schema=self.info.features.arrow_schema)
+
+    def convert_shard(self, column_names, content, posts_index, fts_index, completed_chunks=0):
+        """Yields the index and table of every chunk of a shard, skipping the chunks
+        completed by previous runs"""
+        for chunk_idx, data_chunk in enumerate(self.read_shard(column_names, content)):
+            if chunk_idx < completed_chunks:
+                continue
+            data_chunk = self.filter_chunk(data_chunk)
+            table = self.chunk_to_table(data_chunk, posts_index)
+            if fts_index is not None:
+                self.index_speeches(fts_index, data_chunk)
+            yield chunk_idx, table
+
+    def checkpoint_key(self):
+        """Name of the checkpoints of the config, from the settings that change the
+        tables only, so that a resume with another num_workers or fts_index_path
+        reuses them. Chunks replayed from the checkpoints are not added to the
+        full-text index"""
+        settings = {name: getattr(self.config, name) for name in _CHECKPOINT_SETTINGS}
+        digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8"))
+        return f"{self.config.name}-{digest.hexdigest()[:16]}"
+
+    def checkpoint_path(self, shard_idx, start):
+        """Directory holding the completed chunks of a shard, None if checkpointing is off"""
+        if self.config.checkpoint_dir is None:
+            return None
+        path = os.path.join(
+            self.config.checkpoint_dir,
+            self.checkpoint_key(),
+            f"shard-{shard_idx:05d}-{start}",
+        )
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def shard_progress(self, shard_idx, start):
+        """Checkpoint of a shard, number of its chunks completed by previous runs and
+        whether it is done"""
+        checkpoint = self.checkpoint_path(shard_idx, start)
+        if checkpoint is None:
+            return None, 0, False
+        completed_chunks = 0
+        while os.path.exists(
+            os.path.join(checkpoint, f"chunk-{completed_chunks:05d}.arrow")
+        ):
+            completed_chunks += 1
+        return checkpoint, completed_chunks, os.path.exists(os.path.join(checkpoint, "done"))
+
+    def read_checkpoint(self, checkpoint):
+        """Yields the tables of the chunks completed by previous runs, in order"""
+        chunk_idx = 0
+        while True:
+            chunk_file = os.path.join(checkpoint, f"chunk-{chunk_idx:05d}.arrow")
+            if not os.path.exists(chunk_file):
+                return
+            with pa.OSFile(chunk_file, "rb") as source:
+                yield chunk_idx, pa.ipc.open_file(source).read_all()
+            chunk_idx += 1
+
+    def write_checkpoint(self, checkpoint, chunk_idx, table):
+        """Saves a completed chunk, atomically so that a crash never leaves half a file"""
+        chunk_file = os.path.join(checkpoint, f"chunk-{chunk_idx:05d}.arrow")
+        with pa.OSFile(chunk_file + ".tmp", "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(chunk_file + ".tmp", chunk_file)
+
+    def open_fts_index(self):
+        """Opens the full-text index, creating its tables on first use. Speeches are
+        stored once per id, so chunks indexed by an interrupted run are skipped"""
+        conn = sqlite3.connect(self.config.fts_index_path, timeout=600)
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS speeches "
+                "(id TEXT PRIMARY KEY, date TEXT, party TEXT, display_as TEXT)"
+            )
+            for column in ["date", "party", "display_as"]:
+                conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS speeches_{column} ON speeches ({column})"
+                )
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS speeches_fts "
+                "USING fts5(speech, content='')"
+            )
+        return conn
+
+    def index_speeches(self, conn, data_chunk):
+        """Adds the speeches of a chunk to the full-text index in one transaction"""
+        data_chunk = data_chunk.fillna("")
+        with conn:
+            for speech_id, date, party, display_as, speech in zip(
+                data_chunk["id"],
+                data_chunk["date"],
+                data_chunk["party"],
+                data_chunk["display_as"],
+                data_chunk["speech"],
+            ):
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO speeches (id, date, party, display_as) "
+                    "VALUES (?, ?, ?, ?)",
+                    (speech_id, date, party, display_as),
+                )
+                if cursor.rowcount:
+                    conn.execute(
+                        "INSERT INTO speeches_fts (rowid, speech) VALUES (?, ?)",
+                        (cursor.lastrowid, speech),
+                    )
+
+    def iter_shard_tables(self, csv_files, json_file, fts_index):
+        """Yields the index, start offset and checkpoint of every shard of the CSV, in
+        order, with the (chunk_idx, table) of its chunks not completed by previous
+        runs, or None if the shard is done. With num_workers > 1 the shards are
+        converted by a pool of processes, with at most two shards per worker in flight"""
+        shards = self.iter_shards(csv_files)
+        if self.config.num_workers <= 1:
+            posts_index = None
+            for shard_idx, start, column_names, content in shards:
+                checkpoint, completed_chunks, done = self.shard_progress(shard_idx, start)
+                if done:
+                    yield shard_idx, start, checkpoint, None
+                    continue
+                if posts_index is None:
+                    posts_index = self.build_posts_index(json_file)
+                yield shard_idx, start, checkpoint, self.convert_shard(
+                    column_names, content, posts_index, fts_index, completed_chunks
+                )
+            return
+        with ProcessPoolExecutor(
+            max_workers=self.config.num_workers,
+            initializer=_init_worker,
+            initargs=(self, self.build_posts_index(json_file)),
+        ) as executor:
+            pending = deque()
+            for shard_idx, start, column_names, content in shards:
+                checkpoint, completed_chunks, done = self.shard_progress(shard_idx, start)
+                future = None
+                if not done:
+                    future = executor.submit(
+                        _convert_shard, column_names, content, completed_chunks
+                    )
+                pending.append((shard_idx, start, checkpoint, future))
+                if len(pending) >= 2 * self.config.num_workers:
+                    shard_idx, start, checkpoint, future = pending.popleft()
+                    yield shard_idx, start, checkpoint, future.result() if future else None
+            while pending:
+                shard_idx, start, checkpoint, future = pending.popleft()
+                yield shard_idx, start, checkpoint, future.result() if future else None
+
+    def _generate_tables(self, csv_files, json_file, split):
+        logger.warn("\nThis is a large dataset. Please be patient")
+        fts_index = None
+        if self.config.fts_index_path is not None:
+            fts_index = self.open_fts_index()
+        for shard_idx, start, checkpoint, tables in self.iter_shard_tables(
+            csv_files, json_file, fts_index
+        ):
+            if checkpoint is not None:
+                completed_chunks = 0
+                for chunk_idx, table in self.read_checkpoint(checkpoint):
+                    completed_chunks = chunk_idx + 1
+                    if table.num_rows:
+                        yield f"{shard_idx}_{chunk_idx}", table
+                if tables is None:
+                    continue
+                if completed_chunks:
+                    logger.info(
+                        f"Resuming shard {shard_idx} after {completed_chunks} completed chunks"
+                    )
+            for chunk_idx, table in tables:
+                if checkpoint is not None:
+                    self.write_checkpoint(checkpoint, chunk_idx, table)
+                if table.num_rows:
+                    yield f"{shard_idx}_{chunk_idx}", table
+            if checkpoint is not None:
+                open(os.path.join(checkpoint, "done"), "w").close()
+        if fts_index is not None:
+            fts_index.close()
@@ -12,10 +12,22 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import io
+import itertools
 import os
+import re
+import shutil
+import uuid
 import datasets
 import glob
+import numpy as np
 import xml.etree.ElementTree as ET
+from array import array
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
 
 _CITATION = """@article{Howard2017,
 author = "Sharon Howard",
@@ -41,9 +53,127 @@ _LICENSE = "Creative Commons Attribution 4.0 International"
 
 _URL = "https://www.dhi.ac.uk/san/data/oldbailey/oldbailey.zip"
 
+# Session files are named after their date, e.g. 16740429.xml or OA16760517.xml
+_FILENAME_DATE_RE = re.compile(r"(?:OA)?(\d{8})\.xml")
+_DATE_BOUND_RE = re.compile(r"\d{4}(?:\d{2}){0,2}")
+
+# Fields of the examples that are indexed by index_path
+_INDEXED_FIELDS = ["persons", "places"]
+# File of index_path holding the name of the sub-directory of the current index
+_INDEX_POINTER = "CURRENT"
+
+# Files sent to a pool worker at once, to amortize the inter-process round trip
+_POOL_BATCH_SIZE = 8
+
 logger = datasets.utils.logging.get_logger(__name__)
 
 
+@dataclass
+class OldBaileyProceedingsConfig(datasets.BuilderConfig):
+    """BuilderConfig for OldBaileyProceedings
+
+    Args:
+        num_workers: number of processes parsing the files of every shard. Mostly
+            useful when streaming, where datasets cannot spread the shards over
+            processes with num_proc. The examples keep the order of the files, so
+            the worker count is left out of the config id and every num_workers
+            shares the same cache
+        start_date: first date (inclusive) of the sessions and accounts to keep, as
+            YYYY, YYYYMM or YYYYMMDD
+        end_date: last date (inclusive) of the sessions and accounts to keep, as
+            YYYY, YYYYMM or YYYYMMDD. Files are selected on the date in their name
+            and only the ones whose name has no date are opened, to read the date
+            interp of their header
+        index_path: directory where an inverted index of the persons and places is
+            written during generation, mapping their normalized names to the ids of
+            the examples that mention them, see `OldBaileyNameIndex`. Every build
+            writes its index to a new sub-directory and then points index_path/CURRENT
+            at it, so readers always see a complete index and the other files of the
+            directory are left alone. The files are then generated in a single
+            process, for the whole index to be collected
+    """
+
+    num_workers: int = field(default=1, compare=False)
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    index_path: Optional[str] = None
+
+    def create_config_id(self, config_kwargs, custom_features=None):
+        config_kwargs = {key: value for key, value in config_kwargs.items() if key != "num_workers"}
+        return super().create_config_id(config_kwargs, custom_features=custom_features)
+
+
+def normalize_name(name):
+    """Normalizes a person or place name for the index: case-folded, with runs of
+    whitespace collapsed to single spaces"""
+    return " ".join(name.split()).casefold()
+
+
+class _EncodedStrings:
+    """Sequence view over UTF-8 strings stored end to end in a uint8 array"""
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        return self.data[self.offsets[idx] : self.offsets[idx + 1]].tobytes()
+
+
+class OldBaileyNameIndex:
+    """Read-only view of an index written with index_path. The arrays are memory-mapped,
+    so opening it is immediate and a lookup is a binary search over the sorted names
+
+    Usage:
+        index = OldBaileyNameIndex("/path/to/index")
+        index.lookup("John Smith")  # ids of the examples mentioning that person
+        index.lookup("Newgate", field="places")
+    """
+
+    def __init__(self, index_path):
+        with open(os.path.join(index_path, _INDEX_POINTER), "r", encoding="utf-8") as fp:
+            index_dir = os.path.join(index_path, fp.read().strip())
+
+        def load(name):
+            return np.lib.format.open_memmap(os.path.join(index_dir, f"{name}.npy"), mode="r")
+
+        self.ids = load("ids")
+        self.names = {
+            field: _EncodedStrings(load(f"{field}_names"), load(f"{field}_name_offsets"))
+            for field in _INDEXED_FIELDS
+        }
+        self.postings = {
+            field: (load(f"{field}_postings"), load(f"{field}_posting_offsets"))
+            for field in _INDEXED_FIELDS
+        }
+
+    def lookup(self, name, field="persons"):
+        """Returns the ids of the examples whose field ("persons" or "places") holds
+        the name, in the order of the examples"""
+        names = self.names[field]
+        key = normalize_name(name).encode("utf-8")
+        idx = bisect_left(names, key)
+        if idx == len(names) or names[idx] != key:
+            return []
+        postings, posting_offsets = self.postings[field]
+        return self.ids[postings[posting_offsets[idx] : posting_offsets[idx + 1]]].tolist()
+
+
+def _normalize(text_snippet):
+    return text_snippet.replace("\n", "").replace("\t", "").strip() if text_snippet else ""
+
+
+def _convert_contents(batch, trials):
+    """Parses the (content, key) of files read by the parent process, in a pool worker"""
+    return [
+        list(OldBaileyProceedings.iter_file_features(io.BytesIO(content), key, trials))
+        for content, key in batch
+    ]
+
+
 class OldBaileyProceedings(datasets.GeneratorBasedBuilder):
     """The dataset consists of 2,163 transcriptions of the Proceedings and 475 Ordinary's Accounts marked up in TEI-XML,
     and contains some documentation covering the data structure and variables. Each Proceedings file represents one session of the court (1674-1913),
@@ -51,7 +181,49 @@ class OldBaileyProceedings(datasets.GeneratorBasedBuilder):
 
     VERSION = datasets.Version("7.2.0")
 
+    BUILDER_CONFIG_CLASS = OldBaileyProceedingsConfig
+
+    BUILDER_CONFIGS = [
+        OldBaileyProceedingsConfig(
+            name="default",
+            version=VERSION,
+            description="One example per session of the Proceedings and per Ordinary's Account",
+        ),
+        OldBaileyProceedingsConfig(
+            name="trials",
+            version=VERSION,
+            description="One example per trial (div1) of the sessions of the Proceedings, with the id of its session",
+        ),
+    ]
+
+    DEFAULT_CONFIG_NAME = "default"
+
     def _info(self):
+        if self.config.name == "trials":
+            features = datasets.Features(
+                {
+                    "id": datasets.Value("string"),
+                    "session_id": datasets.Value("string"),
+                    "text": datasets.Value("string"),
+                    "places": datasets.Sequence(datasets.Value("string")),
+                    "type": datasets.Value("string"),
+                    "persons": datasets.Sequence(datasets.Value("string")),
+                    "date": datasets.Value("string"),
+                    "person_spans": datasets.Sequence(
+                        {"start": datasets.Value("int32"), "end": datasets.Value("int32")}
+                    ),
+                    "place_spans": datasets.Sequence(
+                        {"start": datasets.Value("int32"), "end": datasets.Value("int32")}
+                    ),
+                }
+            )
+            return datasets.DatasetInfo(
+                description=_DESCRIPTION,
+                features=features,
+                homepage=_HOMEPAGE,
+                license=_LICENSE,
+                citation=_CITATION,
+            )
         features = datasets.Features(
             {
                 "id": datasets.Value("string"),
@@ -60,6 +232,12 @@ class OldBaileyProceedings(datasets.GeneratorBasedBuilder):
                 "type": datasets.Value("string"),
                 "persons": datasets.Sequence(datasets.Value("string")),
                 "date": datasets.Value("string"),
+                "person_spans": datasets.Sequence(
+                    {"start": datasets.Value("int32"), "end": datasets.Value("int32")}
+                ),
+                "place_spans": datasets.Sequence(
+                    {"start": datasets.Value("int32"), "end": datasets.Value("int32")}
+                ),
             }
         )
         return datasets.DatasetInfo(
@@ -74,76 +252,369 @@ class OldBaileyProceedings(datasets.GeneratorBasedBuilder):
         data_dir = dl_manager.download_and_extract(_URL)
         oa_dir = "ordinarysAccounts"
         obp_dir = "sessionsPapers"
+        data_dirs = {
+            "OA": os.path.join(data_dir, oa_dir),
+            "OBP": os.path.join(data_dir, obp_dir),
+        }
+        # Sorted so that shards, and the order of the examples, do not depend on the file system
+        files = [
+            (key, file)
+            for key, data_dir in data_dirs.items()
+            for file in sorted(glob.glob(os.path.join(data_dir, "*.xml")))
+            # Only the sessions of the Proceedings are made of trials
+            if self.config.name != "trials" or key == "OBP"
+        ]
+        date_range = self.date_range()
+        if date_range is not None:
+            # Files without a date in their name are kept here and checked when generating
+            files = [
+                (key, file)
+                for key, file in files
+                if self.in_date_range(self.filename_date(file), date_range) is not False
+            ]
+        if self.config.index_path is not None:
+            # The index is collected as the examples are generated, a tuple is not sharded
+            files = tuple(files)
         return [
             datasets.SplitGenerator(
                 name=datasets.Split.TRAIN,
                 gen_kwargs={
-                    "data_dirs": {
-                        "OA": os.path.join(data_dir, oa_dir),
-                        "OBP": os.path.join(data_dir, obp_dir),
-                    },
+                    "files": files,
                 },
             ),
         ]
 
-    def convert_text_to_features(self, file, key):
+    def date_range(self):
+        """Returns the inclusive (start, end) YYYYMMDD bounds of the config, or None"""
+        if self.config.start_date is None and self.config.end_date is None:
+            return None
+        for bound in [self.config.start_date, self.config.end_date]:
+            if bound is not None and not _DATE_BOUND_RE.fullmatch(bound):
+                raise ValueError(f"Expected a date as YYYY, YYYYMM or YYYYMMDD, got {bound!r}")
+        start = (self.config.start_date or "").ljust(8, "0")
+        end = (self.config.end_date or "").ljust(8, "9")
+        return start, end
+
+    @staticmethod
+    def filename_date(file):
+        match = _FILENAME_DATE_RE.fullmatch(os.path.basename(file))
+        return match.group(1) if match else None
+
+    @staticmethod
+    def in_date_range(date, date_range):
+        """Returns whether the date is in the range, None when the date is unknown"""
+        if date is None:
+            return None
+        start, end = date_range
+        return start <= date <= end
+
+    @staticmethod
+    def read_date(file):
+        """Returns the value of the first date interp of the first ./text/body/div0,
+        reading the file only up to it, or None when there is no such interp"""
+        stack = []
+        with open(file, "rb") as fp:
+            for event, elem in ET.iterparse(fp, events=("start", "end")):
+                if event == "end":
+                    stack.pop()
+                    if len(stack) == 3:
+                        # The first div0 has been read through
+                        if elem.tag == "div0" and [e.tag for e in stack[1:]] == ["text", "body"]:
+                            return None
+                    elem.clear()
+                    continue
+                stack.append(elem)
+                if (
+                    len(stack) == 5
+                    and elem.tag == "interp"
+                    and elem.get("type") == "date"
+                    and [e.tag for e in stack[1:4]] == ["text", "body", "div0"]
+                ):
+                    return elem.attrib["value"]
+        return None
+
+    def keep_file(self, file, date_range):
+        """Checks a file against the date range, reading its header date when its name
+        has none. Files whose header cannot be read are kept, for the error to be
+        reported when they are parsed"""
+        in_range = self.in_date_range(self.filename_date(file), date_range)
+        if in_range is None:
+            try:
+                in_range = self.in_date_range(self.read_date(file), date_range)
+            except Exception:
+                return True
+        return bool(in_range)
+
+    @staticmethod
+    def iter_contents(file, root_tag, header):
+        """Streams the file and yields every element matching root_tag under the first
+        ./text/body/div0 as soon as it is complete. The attributes of that div0 and of
+        its first date interp are stored in header when they are seen. Finished elements
+        are cleared and detached, so only the open ancestors and the current content
+        element are held in memory, whatever the size of the file"""
+        path = root_tag.split("/")
+        stack = []
+        div0 = None
+        content = None
+        if isinstance(file, str):
+            file = open(file, "rb")
+        with file:
+            for event, elem in ET.iterparse(file, events=("start", "end")):
+                if event == "start":
+                    stack.append(elem)
+                    if content is not None:
+                        continue
+                    if div0 is None:
+                        if len(stack) == 4 and [e.tag for e in stack[1:]] == ["text", "body", "div0"]:
+                            div0 = elem
+                            header["div0"] = dict(elem.attrib)
+                    elif len(stack) > 4 and stack[3] is div0:
+                        if (
+                            len(stack) == 5
+                            and elem.tag == "interp"
+                            and elem.get("type") == "date"
+                            and "date" not in header
+                        ):
+                            header["date"] = dict(elem.attrib)
+                        if len(stack) == 4 + len(path) and [e.tag for e in stack[4:]] == path:
+                            content = elem
+                    continue
+                stack.pop()
+                if content is not None:
+                    if elem is not content:
+                        continue
+                    content = None
+                    yield elem
+                elem.clear()
+                if stack:
+                    stack[-1].remove(elem)
+
+    @staticmethod
+    def extract_features(contents):
+        """Extracts the text of the content elements, with the persons and places
+        they contain and the spans of these in the text. A person or place is the
+        normalized text of its element, snippets joined by spaces as in the text, so
+        that text[start:end] == persons[i] for person_spans and == places[i] for
+        place_spans"""
+        text_parts = []
+        places, persons = [], []
+        place_spans = {"start": [], "end": []}
+        person_spans = {"start": [], "end": []}
+        # Length of the text so far, its snippets being joined by single spaces
+        text_length = -1
+        for content in contents:
+            # One pass over the element: its own text, then every child with its
+            # descendants and its tail. The persName and placeName children are
+            # recorded as ranges of snippets, turned into spans at the end
+            content_parts = []
+            entities = []
+            if content.find("persName") is None and content.find("placeName") is None:
+                children = ()
+                text_snippets = content.itertext()
+            else:
+                children = content
+                text_snippets = [content.text] if content.text else ()
+            for text_snippet in text_snippets:
+                text_snippet = text_snippet.replace("\n", "").replace("\t", "").strip()
+                if text_snippet:
+                    content_parts.append(text_snippet)
+            for child in children:
+                first_part = len(content_parts)
+                for text_snippet in child.itertext():
+                    text_snippet = text_snippet.replace("\n", "").replace("\t", "").strip()
+                    if text_snippet:
+                        content_parts.append(text_snippet)
+                if len(content_parts) > first_part:
+                    if child.tag == "persName":
+                        entities.append((person_spans, first_part, len(content_parts)))
+                        persons.append(" ".join(content_parts[first_part:]))
+                    elif child.tag == "placeName" and _normalize(child.text):
+                        entities.append((place_spans, first_part, len(content_parts)))
+                        places.append(" ".join(content_parts[first_part:]))
+                text_snippet = child.tail
+                if text_snippet:
+                    text_snippet = text_snippet.replace("\n", "").replace("\t", "").strip()
+                    if text_snippet:
+                        content_parts.append(text_snippet)
+            if not content_parts:
+                continue
+            # Lengths of the snippets up to every one of them. The element starts one
+            # character after the text so far, and its snippets are joined by spaces
+            part_ends = list(itertools.accumulate(map(len, content_parts)))
+            for spans, first_part, end_part in entities:
+                start = part_ends[first_part - 1] + first_part if first_part else 0
+                spans["start"].append(text_length + 1 + start)
+                spans["end"].append(text_length + part_ends[end_part - 1] + end_part)
+            text_length += part_ends[-1] + len(content_parts)
+            # Joined per element, so that the snippets of the finished elements
+            # do not outlive them as separate strings
+            text_parts.append(" ".join(content_parts))
+        return {
+            "text": " ".join(text_parts),
+            "places": places,
+            "persons": persons,
+            "person_spans": person_spans,
+            "place_spans": place_spans,
+        }
+
+    @staticmethod
+    def convert_text_to_features(file, key):
+        """Extracts the features of a file, given as a path or a binary file object.
+        Returns (0, features), or (-1, the repr of the error) when it cannot be parsed"""
         if key == "OA":
             root_tag = "p"
         else:
             root_tag = "div1/p"
         try:
-            xml_data = ET.parse(file)
-            root = xml_data.getroot()
-            start = root.find("./text/body/div0")
-            id = start.attrib["id"]
-            date = start.find("interp[@type='date']").attrib["value"]
-            text_parts = []
-            places, persons = [], []
-            for content in start.findall(root_tag):
-                for place in content.findall("placeName"):
-                    if place.text:
-                        place_name = place.text.replace("\n", "").strip()
-                    if place_name:
-                        places.append(place.text)
-                for person in content.findall("persName"):
-                    full_name = []
-                    for name_part in person.itertext():
-                        name_part = (
-                            name_part.replace("\n", "").replace("\t", "").strip()
-                        )
-                        if name_part:
-                            full_name.append(name_part)
-                    if full_name:
-                        persons.append(" ".join(full_name))
-                for text_snippet in content.itertext():
-                    text_snippet = (
-                        text_snippet.replace("\n", "").replace("\t", "").strip()
-                    )
-                    if text_snippet:
-                        text_parts.append(text_snippet)
-            full_text = " ".join(text_parts)
+            header = {}
+            features = OldBaileyProceedings.extract_features(
+                OldBaileyProceedings.iter_contents(file, root_tag, header)
+            )
+            id = header["div0"]["id"]
+            date = header["date"]["value"]
             return (
                 0,
                 {
                     "id": id,
                     "date": date,
                     "type": key,
-                    "places": places,
-                    "persons": persons,
-                    "text": full_text,
+                    **features,
                 },
             )
         except Exception as e:
             return -1, repr(e)
 
-    def _generate_examples(self, data_dirs):
-        for key, data_dir in data_dirs.items():
-            for file in glob.glob(os.path.join(data_dir, "*.xml")):
-                status_code, ret_val = self.convert_text_to_features(file, key)
-                if status_code:
-                    logger.exception(
-                        f"{os.path.basename(file)} could not be parsed properly"
+    @staticmethod
+    def convert_trials_to_features(file):
+        """Yields (0, features) for every div1 of a session file as soon as it has been
+        read, or (-1, the repr of the error) for the ones that cannot be converted.
+        A parse error ends the file, after the trials read before it"""
+        header = {}
+        try:
+            for div1 in OldBaileyProceedings.iter_contents(file, "div1", header):
+                try:
+                    features = OldBaileyProceedings.extract_features(div1.findall("p"))
+                    date = div1.find("interp[@type='date']")
+                    yield (
+                        0,
+                        {
+                            "id": div1.attrib["id"],
+                            "session_id": header["div0"]["id"],
+                            "date": date.attrib["value"] if date is not None else header["date"]["value"],
+                            "type": div1.get("type", ""),
+                            **features,
+                        },
                     )
-                    continue
-                else:
-                    yield ret_val["id"], ret_val
+                except Exception as e:
+                    yield -1, repr(e)
+        except Exception as e:
+            yield -1, repr(e)
+
+    @staticmethod
+    def iter_file_features(file, key, trials):
+        """Yields the results of the conversion of a file: one per trial of the session
+        files for the trials config, else one for the whole file"""
+        if trials:
+            yield from OldBaileyProceedings.convert_trials_to_features(file)
+        else:
+            yield OldBaileyProceedings.convert_text_to_features(file, key)
+
+    def iter_converted(self, files):
+        """Yields the file and every result of its conversion, in order. With
+        num_workers > 1 the files are read here and parsed by a pool of processes, in
+        batches of _POOL_BATCH_SIZE files with at most two batches per worker in flight"""
+        trials = self.config.name == "trials"
+        if self.config.num_workers <= 1:
+            for key, file in files:
+                for result in self.iter_file_features(file, key, trials):
+                    yield file, result
+            return
+        with ProcessPoolExecutor(max_workers=self.config.num_workers) as executor:
+            pending = deque()
+            batch_files, batch = [], []
+            for key, file in files:
+                with open(file, "rb") as fp:
+                    batch.append((fp.read(), key))
+                batch_files.append(file)
+                if len(batch) == _POOL_BATCH_SIZE:
+                    pending.append((batch_files, executor.submit(_convert_contents, batch, trials)))
+                    batch_files, batch = [], []
+                if len(pending) >= 2 * self.config.num_workers:
+                    batch_files_done, future = pending.popleft()
+                    for file_done, results in zip(batch_files_done, future.result()):
+                        for result in results:
+                            yield file_done, result
+            if batch:
+                pending.append((batch_files, executor.submit(_convert_contents, batch, trials)))
+            while pending:
+                batch_files_done, future = pending.popleft()
+                for file_done, results in zip(batch_files_done, future.result()):
+                    for result in results:
+                        yield file_done, result
+
+    def write_name_index(self, ids, postings):
+        """Writes the index of the example ids and of the examples of every name. The
+        arrays are written to a new sub-directory of index_path, which the pointer file
+        is then atomically switched to. Only the sub-directory of the previous index is
+        removed after that"""
+        index_path = self.config.index_path
+        pointer_path = os.path.join(index_path, _INDEX_POINTER)
+        previous_dir = None
+        if os.path.exists(pointer_path):
+            with open(pointer_path, "r", encoding="utf-8") as fp:
+                previous_dir = fp.read().strip()
+        index_dir = f"index-{uuid.uuid4().hex}"
+        os.makedirs(os.path.join(index_path, index_dir))
+
+        def save(name, values):
+            np.save(os.path.join(index_path, index_dir, f"{name}.npy"), values)
+
+        def save_strings(name, offsets_name, strings):
+            encoded = [string.encode("utf-8") for string in strings]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            np.cumsum([len(string) for string in encoded], out=offsets[1:])
+            save(name, np.frombuffer(b"".join(encoded), dtype=np.uint8))
+            save(offsets_name, offsets)
+
+        # The ids are short, they are stored with a fixed width to be gathered at once
+        save("ids", np.array(ids, dtype=str))
+        for field in _INDEXED_FIELDS:
+            # Sorted on their UTF-8 bytes, the order the lookups search in
+            names = sorted(postings[field], key=lambda name: name.encode("utf-8"))
+            save_strings(f"{field}_names", f"{field}_name_offsets", names)
+            offsets = np.zeros(len(names) + 1, dtype=np.int64)
+            np.cumsum([len(postings[field][name]) for name in names], out=offsets[1:])
+            save(
+                f"{field}_postings",
+                np.array([idx for name in names for idx in postings[field][name]], dtype=np.uint32),
+            )
+            save(f"{field}_posting_offsets", offsets)
+        with open(pointer_path + ".tmp", "w", encoding="utf-8") as fp:
+            fp.write(index_dir)
+        os.replace(pointer_path + ".tmp", pointer_path)
+        if previous_dir and previous_dir.startswith("index-") and os.sep not in previous_dir:
+            shutil.rmtree(os.path.join(index_path, previous_dir), ignore_errors=True)
+        logger.info(f"Wrote the index of {len(ids)} examples to {index_path}")
+
+    def _generate_examples(self, files):
+        date_range = self.date_range()
+        if date_range is not None:
+            files = ((key, file) for key, file in files if self.keep_file(file, date_range))
+        if self.config.index_path is not None:
+            ids = []
+            postings = {field: {} for field in _INDEXED_FIELDS}
+        for file, (status_code, ret_val) in self.iter_converted(files):
+            if status_code:
+                logger.exception(
+                    f"{os.path.basename(file)} could not be parsed properly"
+                )
+                continue
+            else:
+                if self.config.index_path is not None:
+                    for field in _INDEXED_FIELDS:
+                        for name in set(map(normalize_name, ret_val[field])):
+                            postings[field].setdefault(name, array("I")).append(len(ids))
+                    ids.append(ret_val["id"])
+                yield ret_val["id"], ret_val
+        if self.config.index_path is not None:
+            self.write_name_index(ids, postings)
@@ -0,0 +1,192 @@
+"""
+Benchmarks the CLMET tag scanner of clmet_3_1.py against the BeautifulSoup
+html.parser parsing it replaced, in files/s and MB/s, on synthetic plain, class and
+pos files with entities, inline tags, comments, unclosed and nested paragraphs and
+malformed tokens. Both parsers must give the same examples on these files and on a
+list of markup edge cases. Needs beautifulsoup4 for the reference parser.
+
+Usage:
+    python scripts/benchmark_clmet_parser.py [--files 1500]
+"""
+
+import argparse
+import importlib.util
+import os
+import random
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+CLMET_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "clmet_3_1", "clmet_3_1.py"
+)
+
+POS_TAGS = ["NN", "VBD", "DT", "IN", "JJ", "SENT", "PP", "nn", "RB", "XYZ"]
+CLASS_TAGS = ["SUBST", "VERB", "ART", "PREP", "ADJ", "PUNC", "PRON", "subst", "QUOT", "ZZZ"]
+WORDS = ["the", "king", "said", "of", "&amp;", "AT&amp;T", "fair", ".", "'", "x&lt;y", "mother's"]
+
+# Bodies that exercise the html.parser tree building rules, after a full header
+EDGE_CASES = [
+    "<text><p>a <b>bold</b> c</p><p>x<br>y</p></text>",
+    "<text><p>a<p>nested</p>b</p></text>",
+    "<text><p><p>a</p> b</p></text>",
+    "<text>\n<p><P></p>\n</text>",
+    "<text><p><b><p>x</p></b> y</p><p></p></text>",
+    "<text><P>Upper</P><p class='x>y'>attr</p></text>",
+    "<text><p>a &amp; &#39; &nbsp; &bogus; & b &copy &notit; &#x1F600;</p></text>",
+    "<text><p>a < b and c<d</p></text>",
+    "<text><p>x<!-- c --> y<?pi?>z</p><p/><p>q</p></text>",
+    "<text><i><p>inside</i>after</p></text><p>outside</p>",
+    "<text><p> \n </p><p>\t</p><p>a\r\nb</p></text>",
+    "<text><p>a</p></text><text><p>second text</p></text>",
+    "<text><p>a<br/>b</p><p>unclosed",
+    "<text><p>a</text> <p>b</p>",
+    "<text><p>a<script>x<p>y</p>&amp;</script>b</p><style type='t'>s</STYLE ></text>",
+    "<text><p>a<script>never closed</p></text>",
+    "<text><p>a<![CDATA[zz&amp;<p>]]>b</p><p><![cdata[  ]]></p></text>",
+    "<text><p>a</ p>b</p><p>c </> d</p><p> </> </p><p>e</ 1>f</p x='>'>g</text>",
+    "<text><p>a<!-- b</p><p>c &amp; d</p></text>",
+    "<text><p>a<![CDATA[ b</p><p>c</p></text>",
+    "<text><text></text><p>in the first text</p></text>",
+]
+
+
+def load_clmet_module():
+    spec = importlib.util.spec_from_file_location("clmet_3_1", CLMET_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def synthetic_header(rng, idx):
+    return "".join(
+        [
+            f"<id>CLMET3_1_{idx % 3 + 1}_{idx}</id>\n",
+            f"<period>{rng.choice(['1710-1780', '1780-1850', '1850-1920'])}</period>\n",
+            "<quartcent>1700-1724</quartcent>\n",
+            f"<decade>{rng.randint(171, 191)}0s</decade>\n",
+            f"<year>1{rng.randint(710, 919)}</year>\n",
+            f"<genre>{rng.choice(['Narrative fiction', 'Letters', 'Drama'])}</genre>\n",
+            f"<subgenre>{rng.choice(['', 'sub &amp; more'])}</subgenre>\n",
+            f"<title>Title {idx} &quot;q&quot;</title>\n",
+            f"<author>Author, A. {idx}</author>\n",
+            "<gender>M</gender>\n",
+            f"<notes>{rng.choice(['', 'a note'])}</notes>\n",
+            f"<comments>{rng.choice(['', 'c <!-- hidden --> d'])}</comments>\n",
+        ]
+    )
+
+
+def synthetic_files(num_files, seed=0):
+    """Returns the contents of num_files documents in each of the three formats"""
+    rng = random.Random(seed)
+    files = {"plain": [], "class": [], "pos": []}
+    for idx in range(num_files):
+        header = synthetic_header(rng, idx)
+        paragraphs = [
+            [rng.choice(WORDS) for _ in range(rng.randint(0, 60))]
+            for _ in range(rng.randint(1, 30))
+        ]
+        for name, tags in [("plain", None), ("class", CLASS_TAGS), ("pos", POS_TAGS)]:
+            body = []
+            for words in paragraphs:
+                if tags is None:
+                    text = " ".join(words)
+                    if rng.random() < 0.2:
+                        text += " <i>italic</i> tail"
+                    if rng.random() < 0.05:
+                        text += " <p>nested</p> after"
+                else:
+                    # Some tokens are malformed: no tag, or two underscores
+                    parts = []
+                    for word in words:
+                        draw = rng.random()
+                        if draw < 0.02:
+                            parts.append(f"{word}_{rng.choice(tags)}_x")
+                        elif draw < 0.04:
+                            parts.append(word)
+                        else:
+                            parts.append(f"{word}_{rng.choice(tags)}")
+                    text = "\n".join(" ".join(parts[pos : pos + 7]) for pos in range(0, len(parts), 7))
+                body.append(f"<p>{text}</p>")
+            files[name].append(header + "<text>\n" + "\n".join(body) + "\n</text>\n")
+    return files
+
+
+def beautifulsoup_parse(module, content, pos_type):
+    """Example of a file as the BeautifulSoup based parse_file built it"""
+    soup = BeautifulSoup(content, features="html.parser")
+    data_point = {
+        "id": soup.id.text,
+        "period": soup.period.text,
+        "genre": soup.genre.text,
+        "subgenre": soup.subgenre.text,
+        "decade": soup.decade.text,
+        "quarter_cent": soup.quartcent.text,
+        "title": soup.title.text,
+        "notes": soup.notes.text,
+        "comments": soup.comments.text,
+        "author": soup.author.text,
+        "year": soup.year.text,
+    }
+    content_parts = soup.find("text").find_all("p")
+    if pos_type in ["pos", "class"]:
+        lookup = module._POS_LOOKUP if pos_type == "pos" else module._CLASS_LOOKUP
+        tokens, pos_tags = [], []
+        for content_part in content_parts:
+            for text_part in content_part.text.strip().split():
+                if text_part.count("_") != 1:
+                    continue
+                token, pos_tag = text_part.split("_")
+                tokens.append(token)
+                pos_tags.append(lookup.get(pos_tag.replace("\n", "").strip().upper(), -1))
+        data_point["text"] = tokens
+        data_point["pos_tags"] = pos_tags
+    else:
+        data_point["text"] = " ".join(content_part.text for content_part in content_parts)
+    return data_point["id"], data_point
+
+
+def scanner_parse(builder, content, pos_type):
+    id, data_point = builder.parse_file(content, pos_type)
+    if "pos_tags" in data_point:
+        data_point["pos_tags"] = data_point["pos_tags"].tolist()
+    return id, data_point
+
+
+def throughput(parse, contents):
+    start = time.perf_counter()
+    results = [parse(content) for content in contents]
+    elapsed = time.perf_counter() - start
+    size = sum(len(content.encode("utf-8")) for content in contents) / 1e6
+    return results, len(contents) / elapsed, size / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=1500)
+    args = parser.parse_args()
+    module = load_clmet_module()
+    module.logger.setLevel("ERROR")
+    builder = module.CLMET_3_1(config_name="plain")
+    header = synthetic_header(random.Random(0), 0)
+    for body in EDGE_CASES:
+        expected = beautifulsoup_parse(module, header + body, "plain")
+        if scanner_parse(builder, header + body, "plain") != expected:
+            raise SystemExit(f"The scanner differs from BeautifulSoup on {body!r}")
+    print(f"{len(EDGE_CASES)} edge cases identical")
+    for pos_type, contents in synthetic_files(args.files).items():
+        expected, soup_files, soup_mb = throughput(
+            lambda content: beautifulsoup_parse(module, content, pos_type), contents
+        )
+        results, scan_files, scan_mb = throughput(
+            lambda content: scanner_parse(builder, content, pos_type), contents
+        )
+        if results != expected:
+            raise SystemExit(f"The scanner differs from BeautifulSoup on the {pos_type} files")
+        print(
+            f"{pos_type}: BeautifulSoup {soup_files:.0f} files/s ({soup_mb:.1f} MB/s), "
+            f"scanner {scan_files:.0f} files/s ({scan_mb:.1f} MB/s)"
+        )
@@ -0,0 +1,69 @@
+"""
+Benchmarks the join of the Hansard speeches with parliamentary_posts.json on a
+synthetic CSV/JSON pair: the original boolean-mask scan of the posts DataFrame for
+every speech against the sorted-array _PostsIndex used by hansard_speech.py. Both
+joins must give the same parliamentary posts.
+
+Usage:
+    python scripts/benchmark_hansard_posts.py [--rows 20000] [--members 500]
+"""
+
+import argparse
+import tempfile
+import time
+
+import pandas as pd
+
+from hansard_synthetic import load_hansard_module, write_synthetic_hansard
+
+
+def mask_scan_join(csv_file, json_file):
+    """Parliamentary posts of every speech, looked up as the original loader did"""
+    json_data = pd.read_json(json_file)
+    posts = []
+    for data_chunk in pd.read_csv(csv_file, chunksize=50000, dtype="object"):
+        data_chunk.fillna("", inplace=True)
+        for _, row in data_chunk.iterrows():
+            parl_post_list = []
+            if row["mnis_id"] and row["date"]:
+                parl_posts = json_data[
+                    (json_data["mnis_id"] == int(row["mnis_id"]))
+                    & (json_data["date"] == row["date"] + " 00:00:00")
+                ]["parliamentary_posts"]
+                if len(parl_posts) > 0:
+                    parl_post_list = [item["parl_post_name"] for item in parl_posts.iloc[0]]
+            posts.append(parl_post_list)
+    return posts
+
+
+def indexed_join(module, csv_file, json_file):
+    """Parliamentary posts of every speech, looked up in the posts index"""
+    with open(json_file, "r", encoding="utf-8") as fp:
+        posts_index = module._PostsIndex.from_records(module._iter_json_records(fp))
+    posts = []
+    for data_chunk in pd.read_csv(csv_file, chunksize=50000, dtype="object"):
+        data_chunk = data_chunk.fillna("")
+        columns = posts_index.lookup(data_chunk["mnis_id"], data_chunk["date"])
+        posts.extend(columns["parliamentary_posts"].to_pylist())
+    return posts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--members", type=int, default=500)
+    args = parser.parse_args()
+    module = load_hansard_module()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_file, json_file = write_synthetic_hansard(tmp_dir, args.rows, args.members)
+        start = time.perf_counter()
+        expected = mask_scan_join(csv_file, json_file)
+        mask_scan_time = time.perf_counter() - start
+        start = time.perf_counter()
+        posts = indexed_join(module, csv_file, json_file)
+        indexed_time = time.perf_counter() - start
+    if posts != expected:
+        raise SystemExit("The indexed join differs from the mask scan")
+    print(f"{args.rows} speeches, {args.members * 10} posts records")
+    print(f"mask scan: {mask_scan_time:.2f}s")
+    print(f"index:     {indexed_time:.2f}s ({mask_scan_time / indexed_time:.0f}x faster)")
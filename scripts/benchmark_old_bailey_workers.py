@@ -0,0 +1,117 @@
+"""
+Benchmarks the process pool of old_bailey_proceedings.py (num_workers) on a
+synthetic archive of session and Ordinary's Account files, and checks that every
+number of workers gives the same examples, in the same order, as the serial path.
+The speedup is bounded by the number of CPU cores, which is printed with the timings.
+
+Usage:
+    python scripts/benchmark_old_bailey_workers.py [--files 1300] [--workers 1 4 16]
+"""
+
+import argparse
+import importlib.util
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import zipfile
+
+import datasets
+
+OLD_BAILEY_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..",
+    "old_bailey_proceedings",
+    "old_bailey_proceedings.py",
+)
+
+WORDS = ["the", "prisoner", "was", "indicted", "for", "stealing", "a", "watch", "&amp;", "guilty"]
+NAMES = [("John", "Smith"), ("Mary", "Jones"), ("Thomas", "Brown"), ("Ann", "Williams")]
+PLACES = ["London", "St. Giles", "Newgate", "Westminster"]
+
+
+def load_old_bailey_module():
+    spec = importlib.util.spec_from_file_location("old_bailey_proceedings", OLD_BAILEY_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def synthetic_paragraph(rng):
+    parts = []
+    for _ in range(rng.randint(1, 12)):
+        draw = rng.random()
+        if draw < 0.2:
+            first, last = rng.choice(NAMES)
+            parts.append(
+                f'<persName id="p{rng.randint(0, 999)}">{first} <hi>{last}</hi>'
+                '<interp inst="x" type="gender" value="male"/></persName>'
+            )
+        elif draw < 0.3:
+            parts.append(f'<placeName id="l{rng.randint(0, 99)}">{rng.choice(PLACES)}</placeName>')
+        else:
+            parts.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 15))))
+    return "<p>" + " ".join(parts) + "</p>"
+
+
+def write_synthetic_archive(path, num_files, seed=0):
+    """Writes num_files Ordinary's Accounts and num_files session files to a zip"""
+    rng = random.Random(seed)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for kind, directory in [("OA", "ordinarysAccounts"), ("OBP", "sessionsPapers")]:
+            for idx in range(num_files):
+                date = f"{rng.randint(1674, 1913)}{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}"
+                body = []
+                for trial_idx in range(rng.randint(0, 8)):
+                    paragraphs = "".join(synthetic_paragraph(rng) for _ in range(rng.randint(1, 5)))
+                    if kind == "OA":
+                        body.append(paragraphs)
+                    else:
+                        body.append(
+                            f'<div1 type="trialAccount" id="t{date}-{trial_idx}">'
+                            f'<interp inst="t" type="date" value="{date}"/>{paragraphs}</div1>'
+                        )
+                xml = (
+                    f'<TEI.2><text><body><div0 type="sessionsPaper" id="{kind}{date}{idx}">'
+                    f'<interp inst="{kind}{date}" type="date" value="{date}"/>'
+                    f'{"".join(body)}</div0></body></text></TEI.2>\n'
+                )
+                name = f"OA{date}{idx}.xml" if kind == "OA" else f"{date}-{idx}.xml"
+                archive.writestr(f"{directory}/{name}", xml)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=1300, help="files per directory")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    logging.disable(logging.ERROR)
+    module = load_old_bailey_module()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        module._URL = os.path.join(tmp_dir, "oldbailey.zip")
+        write_synthetic_archive(module._URL, args.files)
+        dl_manager = datasets.DownloadManager(
+            dataset_name="old_bailey_proceedings",
+            download_config=datasets.DownloadConfig(cache_dir=os.path.join(tmp_dir, "downloads")),
+        )
+        print(f"{2 * args.files} files, {os.cpu_count()} CPU cores, best of {args.repeats}")
+        expected = None
+        for num_workers in args.workers:
+            builder = module.OldBaileyProceedings(
+                cache_dir=os.path.join(tmp_dir, "cache"), num_workers=num_workers
+            )
+            gen_kwargs = builder._split_generators(dl_manager)[0].gen_kwargs
+            timings = []
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                examples = list(builder._generate_examples(**gen_kwargs))
+                timings.append(time.perf_counter() - start)
+            if expected is None:
+                expected = examples
+            elif examples != expected:
+                raise SystemExit(f"{num_workers} workers give different examples")
+            print(f"{num_workers:>3} workers: {min(timings):.2f}s")
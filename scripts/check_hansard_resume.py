@@ -0,0 +1,101 @@
+"""
+Checks that an interrupted Hansard build with checkpoint_dir resumes to the same
+tables as an uninterrupted build. Generation runs on a synthetic CSV/JSON pair with
+small shards and chunks, so that the interruptions fall both between shards and in
+the middle of a shard, and is stopped after a number of tables as a preemption
+would. Every config is checked serially, with a pool of workers, and interrupted
+with a pool then resumed serially, which must reuse the same checkpoints.
+
+Usage:
+    python scripts/check_hansard_resume.py [--rows 20000]
+"""
+
+import argparse
+import functools
+import os
+import tempfile
+
+import datasets
+
+from hansard_synthetic import load_hansard_module, write_synthetic_hansard
+
+SHARD_SIZE = 400 * 1024
+CHUNK_SIZE = 500
+INTERRUPTIONS = [3, 17, 40]
+# num_workers of the interrupted builds and of the resumed build
+WORKERS = [(1, 1), (2, 2), (2, 1)]
+CONFIGS = [
+    {},
+    {"parties": ["Labour"], "start_year": 2000},
+    {"config_name": "metadata", "encode_categoricals": True},
+]
+
+
+class Preempted(Exception):
+    pass
+
+
+def build(module, cache_dir, stop_after=None, **config_kwargs):
+    """Keys and tables of a build, raising Preempted after stop_after tables"""
+    builder = module.HansardSpeech(cache_dir=cache_dir, **config_kwargs)
+    builder.iter_shards = functools.partial(builder.iter_shards, shard_size=SHARD_SIZE)
+    gen_kwargs = builder._split_generators(datasets.DownloadManager())[0].gen_kwargs
+    tables = []
+    generator = builder._generate_tables(**gen_kwargs)
+    for key, table in generator:
+        tables.append((key, table))
+        if stop_after is not None and len(tables) == stop_after:
+            generator.close()
+            raise Preempted
+    return tables
+
+
+def same_tables(tables, expected):
+    return len(tables) == len(expected) and all(
+        key == expected_key and table.equals(expected_table)
+        for (key, table), (expected_key, expected_table) in zip(tables, expected)
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    args = parser.parse_args()
+    module = load_hansard_module()
+    module._CHUNK_SIZE = CHUNK_SIZE
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_file, json_file = write_synthetic_hansard(os.path.join(tmp_dir, "data"), args.rows)
+        module._URLS = {"csv": csv_file, "json": json_file}
+        cache_dir = os.path.join(tmp_dir, "cache")
+        for config_idx, config_kwargs in enumerate(CONFIGS):
+            expected = build(module, cache_dir, **config_kwargs)
+            for interrupted_workers, resumed_workers in WORKERS:
+                checkpoint_dir = os.path.join(
+                    tmp_dir, f"checkpoint-{config_idx}-{interrupted_workers}-{resumed_workers}"
+                )
+                kwargs = dict(config_kwargs, checkpoint_dir=checkpoint_dir)
+                for stop_after in INTERRUPTIONS:
+                    try:
+                        build(module, cache_dir, stop_after, num_workers=interrupted_workers, **kwargs)
+                    except Preempted:
+                        pass
+                resumed = build(module, cache_dir, num_workers=resumed_workers, **kwargs)
+                # A finished build is replayed from the checkpoints alone
+                replayed = build(module, cache_dir, num_workers=resumed_workers, **kwargs)
+                # Every interruption and the resume share one checkpoint directory
+                checkpoints = os.listdir(checkpoint_dir)
+                ok = (
+                    len(checkpoints) == 1
+                    and same_tables(resumed, expected)
+                    and same_tables(replayed, expected)
+                )
+                failures += not ok
+                print(
+                    f"{config_kwargs or 'default'}, num_workers="
+                    f"{interrupted_workers} then {resumed_workers}: "
+                    f"{sum(table.num_rows for _, table in expected)} rows, "
+                    f"{'same as' if ok else 'DIFFERENT from'} the uninterrupted build"
+                )
+    if failures:
+        raise SystemExit(f"{failures} resumed builds differ from the uninterrupted build")
@@ -0,0 +1,117 @@
+"""
+Writes a synthetic Hansard CSV, its zip archive and a parliamentary_posts.json with
+the layout of the real files, for the benchmarks and checks of hansard_speech.py.
+Speeches contain quotes, commas and newlines, so records span several lines.
+
+Usage:
+    python scripts/hansard_synthetic.py OUTPUT_DIR [--rows 20000] [--members 500]
+"""
+
+import argparse
+import csv
+import importlib.util
+import json
+import os
+import random
+import sys
+import zipfile
+
+HANSARD_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "hansard_speech", "hansard_speech.py"
+)
+
+
+def load_hansard_module():
+    """Imports hansard_speech.py from the repository, once. The module is registered
+    so that datasets and the pool workers can find it by name"""
+    if "hansard_speech" in sys.modules:
+        return sys.modules["hansard_speech"]
+    spec = importlib.util.spec_from_file_location("hansard_speech", HANSARD_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def write_synthetic_hansard(output_dir, rows=20000, members=500, seed=0):
+    """Writes the files and returns the paths of the CSV zip and of the JSON"""
+    rng = random.Random(seed)
+    module = load_hansard_module()
+    os.makedirs(output_dir, exist_ok=True)
+    dates = [
+        f"{year}-{month:02d}-{day:02d}"
+        for year in range(1979, 2021)
+        for month in (1, 4, 7, 10)
+        for day in (3, 17)
+    ]
+    posts = [f"Secretary of State {idx}" for idx in range(40)]
+    records = []
+    for mnis_id in range(1, members + 1):
+        for date in rng.sample(dates, 10):
+            records.append(
+                {
+                    "mnis_id": mnis_id,
+                    "date": date,
+                    "parliamentary_posts": [
+                        {"parl_post_name": rng.choice(posts)} for _ in range(rng.randint(0, 2))
+                    ],
+                    "government_posts": [
+                        {"gov_post_name": rng.choice(posts)} for _ in range(rng.randint(0, 1))
+                    ],
+                    "opposition_posts": [
+                        {"opp_post_name": rng.choice(posts)} for _ in range(rng.randint(0, 1))
+                    ],
+                }
+            )
+    json_file = os.path.join(output_dir, "parliamentary_posts.json")
+    with open(json_file, "w", encoding="utf-8") as fp:
+        json.dump(records, fp)
+
+    csv_file = os.path.join(output_dir, module._CSV_FILENAME)
+    words = ["the", "hon.", "Member", '"quoted"', "line\nbreak", "a,b"]
+    with open(csv_file, "w", newline="", encoding="utf-8") as fp:
+        writer = csv.writer(fp)
+        writer.writerow(module.fields[:-3])
+        for idx in range(rows):
+            # Half of the speeches fall on the date of a posts record
+            date = rng.choice(dates) if rng.random() < 0.5 else rng.choice(records)["date"]
+            mnis_id = rng.randint(1, members) if rng.random() < 0.9 else ""
+            speech = " ".join(rng.choice(words) for _ in range(rng.randint(0, 40)))
+            writer.writerow(
+                [
+                    f"uk.org.publicwhip/debate/{idx}",
+                    speech,
+                    f"Speaker {mnis_id}",
+                    rng.choice(["Conservative", "Labour", "Liberal Democrat", "SNP", ""]),
+                    f"Constituency {idx % 50}",
+                    mnis_id,
+                    date,
+                    "",
+                    str(idx % 900),
+                    rng.choice(["Speech", "Procedural", "Division"]),
+                    f"Heading {idx % 30}",
+                    "",
+                    "",
+                    date[:4],
+                    "",
+                    "",
+                    "",
+                    "",
+                    "",
+                ]
+            )
+    zip_file = csv_file + ".zip"
+    with zipfile.ZipFile(zip_file, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.write(csv_file, module._CSV_FILENAME)
+    os.remove(csv_file)
+    return zip_file, json_file
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("output_dir")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--members", type=int, default=500)
+    args = parser.parse_args()
+    for path in write_synthetic_hansard(args.output_dir, args.rows, args.members):
+        print(path)